@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tools are imported the way they run as scripts, so that src/__init__ doesn't load the app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
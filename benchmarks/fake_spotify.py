@@ -0,0 +1,370 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from spotify_client import SpotifyClient, endpoint_name
+
+BASE62_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+TIME_RANGES = ("short_term", "medium_term", "long_term")
+# the most items a single page of each endpoint returns, as documented by Spotify
+PAGE_LIMITS = {
+    "me/playlists": 50,
+    "users/{id}/playlists": 50,
+    "playlists/{id}/tracks": 100,
+    "me/tracks": 50,
+    "me/top/tracks": 50,
+    "me/top/artists": 50,
+    "recommendations": 100,
+    "search": 50,
+}
+IDS_LIMITS = {"tracks": 50, "artists": 50, "albums": 20, "me/tracks": 50}
+TOP_ITEMS_TOTAL = 200
+_SEARCH_QUERY = re.compile(r"track:(?P<track>.*) artist:(?P<artist>.*)")
+
+
+def make_id(rng: random.Random) -> str:
+    return "".join(rng.choices(BASE62_ALPHABET, k=22))
+
+
+class FakeError(Exception):
+    def __init__(self, status: int, message: str, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class FakeLibrary:
+    # in-memory state of the Spotify account the fake API serves, plus one friend
+    def __init__(self, size: int, seed: int = 0):
+        rng = random.Random(seed)
+        self.size = size
+        self.me = "fake_user"
+        self.friend = "fake_friend"
+        self._rng = rng
+        self._lock = threading.Lock()
+        artists = [
+            {"id": make_id(rng), "name": f"Artist {i}", "genres": []}
+            for i in range(max(1, size // 10))
+        ]
+        albums = [{"id": make_id(rng), "name": f"Album {i}"} for i in range(max(1, size // 10))]
+        self.artists = {a["id"]: a for a in artists}
+        self.albums = {a["id"]: a for a in albums}
+        self.tracks = {}
+        for i in range(2 * size):
+            artist = artists[i % len(artists)]
+            track = {
+                "id": make_id(rng),
+                "name": f"Song {i}",
+                "artists": [{"id": artist["id"], "name": artist["name"]}],
+                "album": albums[i % len(albums)],
+                "duration_ms": 180000,
+            }
+            self.tracks[track["id"]] = track
+        self.by_name = {
+            (t["name"].lower(), t["artists"][0]["name"].lower()): t for t in self.tracks.values()
+        }
+        catalog = list(self.tracks)
+        now = datetime.now(timezone.utc)
+        self.saved = [
+            (track_id, (now - timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M:%SZ"))
+            for i, track_id in enumerate(rng.sample(catalog, size))
+        ]
+        self.top = {r: rng.sample(catalog, min(size, TOP_ITEMS_TOTAL)) for r in TIME_RANGES}
+        self.top_artists = {r: rng.sample(list(self.artists), len(artists)) for r in TIME_RANGES}
+        self.playlists = {}
+        self.user_playlists = {self.me: [], self.friend: []}
+        # a third of both blend playlists is shared, the rest is their own
+        shared = rng.sample(catalog, size // 3)
+        self.create_playlist(self.me, "my_blend", shared + rng.sample(catalog, size - len(shared)))
+        self.create_playlist(
+            self.friend, "friends_blend", shared + rng.sample(catalog, size - len(shared))
+        )
+        self.create_playlist(self.me, "Your Top Songs 2020", rng.sample(catalog, size // 2))
+        for i in range(size // 10):
+            self.create_playlist(self.me, f"Playlist {i}", rng.sample(catalog, min(size, 20)))
+        # what the migrator reads from YouTube Music: mostly catalog tracks, some unknown to it
+        self.yt_playlists = {
+            "Your Likes": self._yt_tracks(rng.sample(catalog, size), size // 10),
+            "My 2020 Year in Review": self._yt_tracks(rng.sample(catalog, 100), 10),
+        }
+
+    def _yt_tracks(self, track_ids: list, unknown: int) -> list:
+        tracks = [
+            {"title": t["name"], "artists": [{"name": t["artists"][0]["name"]}]}
+            for t in map(self.tracks.get, track_ids)
+        ]
+        unknown_tracks = [
+            {"title": f"Unknown {i}", "artists": [{"name": "Nobody"}]} for i in range(unknown)
+        ]
+        return tracks + unknown_tracks
+
+    def create_playlist(self, user: str, name: str, track_ids=(), description=""):
+        with self._lock:
+            playlist = {
+                "id": make_id(self._rng),
+                "name": name,
+                "description": description,
+                "owner": {"id": user},
+                "public": False,
+                "snapshot_id": make_id(self._rng),
+                "track_ids": list(track_ids),
+            }
+            self.playlists[playlist["id"]] = playlist
+            # newest playlists are listed first, the same as on Spotify
+            self.user_playlists[user].insert(0, playlist["id"])
+            return self.simplified_playlist(playlist)
+
+    def simplified_playlist(self, playlist: dict) -> dict:
+        result = {k: v for k, v in playlist.items() if k != "track_ids"}
+        result["tracks"] = {"total": len(playlist["track_ids"])}
+        return result
+
+    def add_to_playlist(self, playlist_id: str, track_ids: list, position=None):
+        with self._lock:
+            playlist = self.playlists[playlist_id]
+            if position is None:
+                position = len(playlist["track_ids"])
+            if position > len(playlist["track_ids"]):
+                raise FakeError(400, "Index out of bounds")
+            playlist["track_ids"][position:position] = track_ids
+            playlist["snapshot_id"] = make_id(self._rng)
+            return {"snapshot_id": playlist["snapshot_id"]}
+
+    def rename_playlist(self, playlist_id: str, name: str):
+        with self._lock:
+            playlist = self.playlists[playlist_id]
+            playlist["name"] = name
+            playlist["snapshot_id"] = make_id(self._rng)
+
+    def save_tracks(self, track_ids: list):
+        added_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        with self._lock:
+            known = {track_id for track_id, _ in self.saved}
+            new = [(t, added_at) for t in dict.fromkeys(track_ids) if t not in known]
+            self.saved[0:0] = new
+
+    def search(self, query: str) -> list:
+        match = _SEARCH_QUERY.fullmatch(query)
+        if not match:
+            return []
+        track = self.by_name.get((match["track"].lower(), match["artist"].lower()))
+        return [track] if track else []
+
+    def recommendations(self, seeds: str, limit: int) -> list:
+        rng = random.Random(seeds)
+        return [self.tracks[t] for t in rng.sample(list(self.tracks), limit)]
+
+
+class FakeYTMusic:
+    # the two YTMusic calls the migrator makes, served from the same library
+    def __init__(self, library: FakeLibrary):
+        self.library = library
+
+    def get_library_playlists(self, limit=25):
+        return [{"playlistId": name, "title": name} for name in self.library.yt_playlists]
+
+    def get_playlist(self, playlist_id: str, limit=100):
+        return {"tracks": self.library.yt_playlists[playlist_id][:limit]}
+
+
+class FakeSpotifyServer:
+    # serves the Spotify Web API endpoints the project uses from a FakeLibrary. Every request
+    # waits `latency` seconds; with `rate_limit` set, requests past that many within `window`
+    # seconds get 429 with Retry-After, like Spotify's rolling window
+    def __init__(self, library: FakeLibrary, latency=0.0, rate_limit=None, window=30.0):
+        self.library = library
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.window = window
+        self.requests = Counter()
+        self.throttled = Counter()
+        self.bytes_sent = Counter()
+        self._recent = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def prefix(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/v1/"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def client(self, **kwargs) -> SpotifyClient:
+        kwargs.setdefault("cache_namespace", self.library.me)
+        sp = SpotifyClient(auth="fake-token", **kwargs)
+        sp.prefix = self.prefix
+        return sp
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests.clear()
+            self.throttled.clear()
+            self.bytes_sent.clear()
+
+    def count_bytes(self, endpoint: str, size: int):
+        with self._lock:
+            self.bytes_sent[endpoint] += size
+
+    def _admit(self, endpoint: str):
+        now = time.monotonic()
+        with self._lock:
+            self.requests[endpoint] += 1
+            if self.rate_limit is None:
+                return
+            self._recent = [t for t in self._recent if t > now - self.window]
+            if len(self._recent) >= self.rate_limit:
+                self.throttled[endpoint] += 1
+                retry_after = math.ceil(self._recent[0] + self.window - now)
+                raise FakeError(429, "API rate limit exceeded", {"Retry-After": str(retry_after)})
+            self._recent.append(now)
+
+    def handle(self, method: str, path: str, query: dict, body):
+        endpoint = endpoint_name(path)
+        self._admit(endpoint)
+        time.sleep(self.latency)
+        segments = path.split("/v1/", 1)[-1].strip("/").split("/")
+        limit = int(query.get("limit", 20))
+        offset = int(query.get("offset", 0))
+        if endpoint in PAGE_LIMITS and not 0 < limit <= PAGE_LIMITS[endpoint]:
+            raise FakeError(400, "Invalid limit")
+        ids = [i for i in query.get("ids", "").split(",") if i]
+        if len(ids) > IDS_LIMITS.get(endpoint, len(ids)):
+            raise FakeError(400, "Too many ids requested")
+        library = self.library
+
+        match (method, endpoint):
+            case ("GET", "me"):
+                return {"id": library.me, "display_name": library.me, "images": []}
+            case ("GET", "users/{id}"):
+                return {"id": segments[1], "display_name": segments[1], "images": []}
+            case ("GET", "me/top/tracks"):
+                items = [library.tracks[t] for t in library.top[query["time_range"]]]
+                return self._page(path, query, items, limit, offset)
+            case ("GET", "me/top/artists"):
+                items = [library.artists[a] for a in library.top_artists[query["time_range"]]]
+                return self._page(path, query, items, limit, offset)
+            case ("GET", "recommendations"):
+                seeds = query.get("seed_tracks", "") + query.get("seed_artists", "")
+                return {"tracks": library.recommendations(seeds, limit)}
+            case ("GET", "me/playlists") | ("GET", "users/{id}/playlists"):
+                user = library.me if endpoint == "me/playlists" else segments[1]
+                items = [
+                    library.simplified_playlist(library.playlists[p])
+                    for p in library.user_playlists.get(user, [])
+                ]
+                return self._page(path, query, items, limit, offset)
+            case ("POST", "users/{id}/playlists"):
+                return library.create_playlist(
+                    segments[1], body["name"], description=body.get("description", "")
+                )
+            case ("GET", "playlists/{id}"):
+                return library.simplified_playlist(self._playlist(segments[1]))
+            case ("GET", "playlists/{id}/tracks"):
+                items = [
+                    {"track": library.tracks[t]} for t in self._playlist(segments[1])["track_ids"]
+                ]
+                return self._page(path, query, items, limit, offset)
+            case ("POST", "playlists/{id}/tracks"):
+                uris = body if isinstance(body, list) else body["uris"]
+                if len(uris) > PAGE_LIMITS["playlists/{id}/tracks"]:
+                    raise FakeError(400, "Too many tracks requested")
+                position = int(query["position"]) if "position" in query else None
+                self._playlist(segments[1])
+                return library.add_to_playlist(
+                    segments[1], [u.rsplit(":", 1)[-1] for u in uris], position
+                )
+            case ("GET", "me/tracks"):
+                items = [
+                    {"added_at": added_at, "track": library.tracks[t]}
+                    for t, added_at in list(library.saved)
+                ]
+                return self._page(path, query, items, limit, offset)
+            case ("PUT", "me/tracks"):
+                library.save_tracks(ids)
+                return None
+            case ("GET", "search"):
+                items = library.search(query["q"])
+                return {"tracks": self._page(path, query, items, limit, offset)}
+            case ("GET", "tracks") | ("GET", "artists") | ("GET", "albums"):
+                known = getattr(library, endpoint)
+                return {endpoint: [known.get(i) for i in ids]}
+        raise FakeError(404, f"{method} {endpoint} is not supported by the fake API")
+
+    def _playlist(self, playlist_id: str) -> dict:
+        playlist = self.library.playlists.get(playlist_id)
+        if playlist is None:
+            raise FakeError(404, "Not found.")
+        return playlist
+
+    def _page(self, path: str, query: dict, items: list, limit: int, offset: int) -> dict:
+        next_url = None
+        if offset + limit < len(items):
+            next_url = (
+                self.prefix.removesuffix("/v1/")
+                + path
+                + "?"
+                + urlencode(dict(query, limit=limit, offset=offset + limit))
+            )
+        return {
+            "items": items[offset : offset + limit],
+            "total": len(items),
+            "limit": limit,
+            "offset": offset,
+            "next": next_url,
+        }
+
+
+def _handler(server: FakeSpotifyServer):
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive, so the benchmark pays for connections the way clients really do
+        protocol_version = "HTTP/1.1"
+
+        def _respond(self):
+            url = urlsplit(self.path)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length)) if length else None
+            headers = {}
+            try:
+                status, result = 200, server.handle(self.command, url.path, query, body)
+            except FakeError as e:
+                status, headers = e.status, e.headers
+                result = {"error": {"status": e.status, "message": str(e)}}
+            data = json.dumps(result).encode() if result is not None else b""
+            server.count_bytes(endpoint_name(url.path), len(data))
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = do_DELETE = _respond
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.fake_spotify import FakeLibrary, FakeSpotifyServer, FakeYTMusic
+from cache import ResponseCache
+from migrator import MigrationJournal, Yt2SpMigrator, migrate
+from playlist_creator import COMMANDS, BlendSource, PlaylistCreator, run_command
+from spotify_client import RequestScheduler
+
+
+class Measurement:
+    def __init__(self, server: FakeSpotifyServer, size: int, name: str):
+        self.server = server
+        self.result = {"size": size, "name": name}
+
+    def __enter__(self):
+        self.server.reset_counters()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.result["seconds"] = round(time.perf_counter() - self._started, 4)
+        self.result["requests"] = sum(self.server.requests.values())
+        self.result["throttled"] = sum(self.server.throttled.values())
+        self.result["bytes"] = sum(self.server.bytes_sent.values())
+        self.result["endpoints"] = dict(self.server.requests)
+
+
+class TimedJournal(MigrationJournal):
+    # times every stage migrate() runs, without changing what the stages do
+    def __init__(self, path: str, server: FakeSpotifyServer, size: int):
+        super().__init__(path)
+        self.server = server
+        self.size = size
+        self.results = []
+
+    def run(self, name: str, func, *args, **kwargs):
+        with Measurement(self.server, self.size, f"migrator:{name}") as m:
+            result = super().run(name, func, *args, **kwargs)
+        self.results.append(m.result)
+        return result
+
+
+def _client(server: FakeSpotifyServer, cache_path: str):
+    # a new client per case, the same as a new CLI process, but on a shared cache file
+    return server.client(cache=ResponseCache(cache_path), scheduler=RequestScheduler())
+
+
+def bench_commands(server: FakeSpotifyServer, cache_path: str, size: int, limit: int) -> list:
+    library = server.library
+    blend_sources = [
+        BlendSource(library.friend, "friends_blend"),
+        BlendSource(None, "my_blend"),
+    ]
+    results = []
+    for command in COMMANDS:
+        playlist_creator = PlaylistCreator(sp=_client(server, cache_path))
+        with Measurement(server, size, command) as m:
+            run_command(playlist_creator, command, "short_term", limit, blend_sources)
+        results.append(m.result)
+    return results
+
+
+def bench_migrator(server: FakeSpotifyServer, cache_path: str, size: int) -> list:
+    migrator = Yt2SpMigrator(
+        None, None, sp=_client(server, cache_path), ytmusic=FakeYTMusic(server.library)
+    )
+    journal = TimedJournal(os.path.join(os.path.dirname(cache_path), "journal.json"), server, size)
+    migrate(migrator, journal)
+    journal.clear()
+    return journal.results
+
+
+def run(sizes: list, latency: float, rate_limit: int, window: float, limit: int, warm: bool):
+    results = []
+    for size in sizes:
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            FakeSpotifyServer(FakeLibrary(size), latency, rate_limit, window) as server,
+        ):
+            cache_path = os.path.join(tmp, "spotify_cache.sqlite")
+            for cache_state in ("cold", "warm") if warm else ("cold",):
+                for result in bench_commands(server, cache_path, size, limit) + bench_migrator(
+                    server, cache_path, size
+                ):
+                    result["cache"] = cache_state
+                    results.append(result)
+                    print(
+                        f"{size:>7} {cache_state:<5} {result['name']:<28} "
+                        f"{result['seconds']:>9.3f}s {result['requests']:>6} requests "
+                        f"{result['throttled']:>4} throttled {result['bytes']:>10} bytes"
+                    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Times the CLI commands and migrator stages against a local fake Spotify API"
+    )
+    parser.add_argument(
+        "-s", "--sizes", nargs="+", type=int, default=[100, 1000], help="Library sizes to run"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=20, help="Milliseconds the fake API waits per request"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        help="Requests the fake API accepts per --window seconds before answering 429",
+    )
+    parser.add_argument("--window", type=float, default=30, help="Rate limit window in seconds")
+    parser.add_argument("-l", "--limit", type=int, default=50, help="Playlist size to generate")
+    parser.add_argument(
+        "--warm", action="store_true", help="Repeat every case on the cache the first run left"
+    )
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+    results = run(
+        args.sizes, args.latency / 1000, args.rate_limit, args.window, args.limit, args.warm
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
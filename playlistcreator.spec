@@ -6,7 +6,9 @@ from PyInstaller.utils.hooks import collect_data_files
 path = os.path.abspath(".")
 
 a = Analysis(
-    ['src\\main.py', 'src\\components.py', 'src\\playlist_creator.py', 'src\\utils.py'],
+    ['src\\main.py', 'src\\components.py', 'src\\playlist_creator.py', 'src\\utils.py',
+     'src\\cache.py', 'src\\spotify_client.py', 'src\\metrics.py',
+     'src\\widgets.py'],
     pathex=[path],
     binaries=[],
     datas=[('.env', '.')],
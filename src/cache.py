@@ -0,0 +1,272 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+CACHE_FILENAME = "spotify_cache.sqlite"
+DEFAULT_MAX_SIZE = 50 * 1024 * 1024
+MISS_TTL = 7 * 24 * 60 * 60
+
+
+def default_cache_path() -> str:
+    return os.path.join(os.environ.get("STORAGE_PATH", os.getcwd()), CACHE_FILENAME)
+
+
+class _Connection:
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        # serializes every statement and commit made through the shared connection
+        self.lock = threading.Lock()
+        self.stores = 0
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+class SqliteStore:
+    # one table (or a few) in the cache file. Every store of a file shares one connection, which
+    # is closed when the last of them is.
+    schema = ()
+
+    def __init__(self, path: str):
+        self.path = path
+        key = os.path.abspath(path)
+        with _connections_lock:
+            connection = _connections.get(key)
+            if connection is None:
+                connection = _connections[key] = _Connection(path)
+            connection.stores += 1
+        self._key = key
+        self._connection = connection
+        self._db = connection.db
+        self._lock = connection.lock
+        with self._lock:
+            for statement in self.schema:
+                self._db.execute(statement)
+            self._db.commit()
+
+    def close(self):
+        with _connections_lock:
+            if self._connection is None:
+                return
+            self._connection.stores -= 1
+            if self._connection.stores == 0:
+                del _connections[self._key]
+                with self._lock:
+                    self._db.close()
+            self._connection = None
+
+
+class ResponseCache(SqliteStore):
+    schema = (
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, value TEXT NOT NULL, "
+        "size INTEGER NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)",
+    )
+
+    def __init__(self, path: str, max_size: int = DEFAULT_MAX_SIZE):
+        super().__init__(path)
+        self.max_size = max_size
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def get(self, endpoint: str, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row and row[1] > now:
+                self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                self._db.commit()
+                self.hits[endpoint] += 1
+                return json.loads(row[0])
+            self.misses[endpoint] += 1
+            return None
+
+    def set(self, endpoint: str, key: str, value, ttl: float):
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, endpoint, data, len(data), now + ttl, now),
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def invalidate(self, *endpoints: str):
+        with self._lock:
+            self._db.executemany(
+                "DELETE FROM responses WHERE endpoint = ?", [(e,) for e in endpoints]
+            )
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def _evict(self, now: float):
+        self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        (size,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if size <= self.max_size:
+            return
+        # least recently used entries go first until the cache fits into max_size again
+        to_delete = []
+        for key, entry_size in self._db.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        ).fetchall():
+            if size <= self.max_size:
+                break
+            to_delete.append((key,))
+            size -= entry_size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        endpoints = set(self.hits) | set(self.misses)
+        return {
+            "hits": sum(self.hits.values()),
+            "misses": sum(self.misses.values()),
+            "entries": entries,
+            "size": size,
+            "endpoints": {
+                e: {"hits": self.hits[e], "misses": self.misses[e]} for e in sorted(endpoints)
+            },
+        }
+
+
+class MatchStore(SqliteStore):
+    schema = (
+        "CREATE TABLE IF NOT EXISTS matches ("
+        "key TEXT PRIMARY KEY, track_id TEXT, matched_at REAL NOT NULL)",
+    )
+
+    def __init__(self, path: str, miss_ttl: float = MISS_TTL):
+        super().__init__(path)
+        self.miss_ttl = miss_ttl
+
+    def get_many(self, keys: list) -> dict:
+        # a stored NULL means the track was searched for and not found; it is retried
+        # once miss_ttl has passed in case the track has been added to the catalog
+        found = {}
+        oldest_miss = time.time() - self.miss_ttl
+        with self._lock:
+            for key in set(keys):
+                row = self._db.execute(
+                    "SELECT track_id, matched_at FROM matches WHERE key = ?", (key,)
+                ).fetchone()
+                if row and (row[0] is not None or row[1] > oldest_miss):
+                    found[key] = row[0]
+        return found
+
+    def set_many(self, matches: dict):
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO matches VALUES (?, ?, ?)",
+                [(key, track_id, now) for key, track_id in matches.items()],
+            )
+            self._db.commit()
+
+
+class LikedTracksStore(SqliteStore):
+    schema = (
+        "CREATE TABLE IF NOT EXISTS liked_tracks ("
+        "namespace TEXT NOT NULL, track_id TEXT NOT NULL, added_at TEXT NOT NULL, "
+        "item TEXT NOT NULL, PRIMARY KEY (namespace, track_id))",
+    )
+
+    def load(self, namespace: str) -> list:
+        # newest first, the same order the saved tracks endpoint uses
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT item FROM liked_tracks WHERE namespace = ? ORDER BY added_at DESC",
+                (namespace,),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def update(self, namespace: str, items: list, replace: bool = False):
+        with self._lock:
+            if replace:
+                self._db.execute("DELETE FROM liked_tracks WHERE namespace = ?", (namespace,))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO liked_tracks VALUES (?, ?, ?, ?)",
+                [(namespace, i["track"]["id"], i["added_at"], json.dumps(i)) for i in items],
+            )
+            self._db.commit()
+
+
+class PlaylistContentStore(SqliteStore):
+    schema = (
+        "CREATE TABLE IF NOT EXISTS playlist_contents ("
+        "playlist_id TEXT PRIMARY KEY, snapshot_id TEXT NOT NULL, track_ids TEXT NOT NULL)",
+    )
+
+    def get(self, playlist_id: str, snapshot_id: str):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT track_ids FROM playlist_contents WHERE playlist_id = ? AND snapshot_id = ?",
+                (playlist_id, snapshot_id),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, playlist_id: str, snapshot_id: str, track_ids: list):
+        # only the latest snapshot of a playlist is kept
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO playlist_contents VALUES (?, ?, ?)",
+                (playlist_id, snapshot_id, json.dumps(track_ids)),
+            )
+            self._db.commit()
+
+
+class TokenStore(SqliteStore):
+    schema = (
+        "CREATE TABLE IF NOT EXISTS tokens (namespace TEXT PRIMARY KEY, token_info TEXT NOT NULL)",
+    )
+
+    def get(self, namespace: str):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT token_info FROM tokens WHERE namespace = ?", (namespace,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, namespace: str, token_info: dict):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO tokens VALUES (?, ?)", (namespace, json.dumps(token_info))
+            )
+            self._db.commit()
+
+
+class ImageStore(SqliteStore):
+    schema = (
+        "CREATE TABLE IF NOT EXISTS images (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT)",
+    )
+
+    def get(self, url: str) -> dict:
+        # validators of the copy downloaded last, for a conditional request
+        with self._lock:
+            row = self._db.execute(
+                "SELECT etag, last_modified FROM images WHERE url = ?", (url,)
+            ).fetchone()
+        return {"etag": row[0], "last_modified": row[1]} if row else {}
+
+    def set(self, url: str, etag: str = None, last_modified: str = None):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?)", (url, etag, last_modified)
+            )
+            self._db.commit()
@@ -1,11 +1,12 @@
+import hashlib
 import os
 import random
+import threading
 from datetime import date
 
 import kivymd.icon_definitions  # noqa
-from kivy.core.window import Window
+from kivy.clock import Clock
 from kivy.logger import Logger
-from kivy.properties import BooleanProperty, StringProperty
 from kivy.uix.widget import Widget
 from kivy.utils import platform
 from kivymd.app import MDApp
@@ -18,37 +19,33 @@ from kivymd.uix.appbar.appbar import (
 )
 from kivymd.uix.boxlayout import MDBoxLayout
 from kivymd.uix.button import MDButton, MDButtonIcon, MDButtonText, MDIconButton
-from kivymd.uix.fitimage import FitImage
 from kivymd.uix.gridlayout import MDGridLayout
 from kivymd.uix.label import MDLabel
-from kivymd.uix.menu import MDDropdownMenu
 from kivymd.uix.screen import MDScreen
-from kivymd.uix.selectioncontrol.selectioncontrol import MDCheckbox
-from kivymd.uix.snackbar.snackbar import (
-    MDSnackbar,
-    MDSnackbarActionButton,
-    MDSnackbarActionButtonText,
-    MDSnackbarButtonContainer,
-    MDSnackbarSupportingText,
-    MDSnackbarText,
-)
-from kivymd.uix.textfield import MDTextField
 
 if platform == "android":
     from exceptions import PlaylistCreatorError, UserInputError
-    from utils import download_from_url
 else:
     from src.exceptions import PlaylistCreatorError, UserInputError
-    from src.utils import download_from_url
 
 __all__ = [
     "PlaylistCreatorLabel",
     "PlaylistCreatorTextButton",
-    "PlaylistCreatorSnackbar",
     "MainScreen",
 ]
 
 
+def deferred_widgets():
+    # widgets that aren't on the first screen live in their own module, imported on first use,
+    # so that their KivyMD modules and kv rules don't hold up the first frame. Code outside this
+    # module imports them from widgets directly.
+    if platform == "android":
+        import widgets
+    else:
+        from src import widgets
+    return widgets
+
+
 class PlaylistCreatorLabel(MDLabel):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -72,84 +69,29 @@ class PlaylistCreatorTextButton(MDButton):
         self.style = "elevated"
 
 
-class PlaylistCreatorSnackbar(MDSnackbar):
-    def __init__(self, *args, **kwargs):
-        text = kwargs["text"]
-        del kwargs["text"]
-        sup_text = kwargs["sup_text"]
-        del kwargs["sup_text"]
-        action_text = kwargs.get("action_text")
-        if action_text:
-            del kwargs["action_text"]
-        on_release = kwargs.get("on_release")
-        if on_release:
-            del kwargs["on_release"]
-        if action_text and on_release:
-            super().__init__(
-                MDSnackbarText(text=text),
-                MDSnackbarSupportingText(text=sup_text),
-                MDSnackbarButtonContainer(
-                    MDSnackbarActionButton(
-                        MDSnackbarActionButtonText(text=action_text),
-                        on_release=lambda x: on_release(),
-                    ),
-                    pos_hint={"center_y": 0.5},
-                ),
-                orientation="horizontal",
-                *args,
-                **kwargs,
-            )
-        else:
-            super().__init__(
-                MDSnackbarText(text=text),
-                MDSnackbarSupportingText(text=sup_text),
-                *args,
-                **kwargs,
-            )
-        self.duration = 7
-        self.style = "elevated"
-        self.pos_hint = {"center_x": 0.5, "center_y": 0.15}
-        self.size_hint_x = 0.7
+class JobRunner:
+    def __init__(self):
+        self._thread = None
 
+    @property
+    def busy(self):
+        return self._thread is not None and self._thread.is_alive()
 
-class PlaylistCreatorInput(MDTextField):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.multiline = False
-        self.pos_hint = {"center_x": 0.5, "center_y": 0.5}
-        if not kwargs.get("size_hint_x"):
-            self.size_hint_x = 0.6
-        self.size_hint_min_x = 50
-
-    def on_touch_down(self, touch):
-        Window.softinput_mode = "pan"
-        super().on_touch_down(touch)
-
-
-class CheckItem(MDBoxLayout):
-    text = StringProperty()
-    group = StringProperty()
-    id = StringProperty()
-    active = BooleanProperty(False)
-
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.orientation = "horizontal"
-        self.pos_hint = {"center_y": 0.5, "right_x": 1}
-        self.spacing = "12dp"
-        self.padding = "12dp"
+    def run(self, job, on_progress, on_done, on_error):
+        # job runs on a worker thread, callbacks are delivered on the main thread via Clock
+        def report_progress(text):
+            Clock.schedule_once(lambda dt: on_progress(text))
 
-        self.checkbox = MDCheckbox(
-            group=self.group, active=self.active, pos_hint=self.pos_hint, id=self.id
-        )
-        self.checkbox.bind(active=self.set_active)
-        self.label = PlaylistCreatorLabel(text=self.text, pos_hint=self.pos_hint)
-
-        self.add_widget(self.checkbox)
-        self.add_widget(self.label)
+        def target():
+            try:
+                result = job(report_progress)
+            except Exception as e:
+                Clock.schedule_once(lambda dt, error=e: on_error(error))
+            else:
+                Clock.schedule_once(lambda dt: on_done(result))
 
-    def set_active(self, checkbox, value):
-        self.active = value
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
 
 
 class PlaylistCreatorTopBar(MDTopAppBar):
@@ -162,20 +104,10 @@ class PlaylistCreatorTopBar(MDTopAppBar):
         self.md_bg_color = app.theme_cls.onSecondaryContainerColor
         self.remove_widget(self.ids.title_box)
 
-        user_icon_url = app.playlist_creator.sp.me()["images"][0]["url"]
-        download_from_url(user_icon_url, os.path.join(app.storage_path, "user-icon.png"))
-        leading_button = MDTopAppBarLeadingButtonContainer(
-            FitImage(
-                source=os.path.join(app.storage_path, "user-icon.png"),
-                size_hint=(None, None),
-                pos_hint={"left_x": 0.0, "center_y": 0.5},
-                radius=["36dp", "36dp", "36dp", "36dp"],
-                fit_mode="contain",
-                size=("64dp", "64dp"),
-            ),
-            size_hint_x=0.5,
-        )
-        self.add_widget(leading_button)
+        # the user icon is added once the profile has been loaded, after the first frame
+        self.user_icon = None
+        self.leading_buttons = MDTopAppBarLeadingButtonContainer(size_hint_x=0.5)
+        self.add_widget(self.leading_buttons)
 
         title = MDTopAppBarTitle(
             text="Playlist Creator",
@@ -206,6 +138,59 @@ class PlaylistCreatorTopBar(MDTopAppBar):
         )
         self.add_widget(trailing_buttons)
 
+    def show_user(self, user: dict, storage_path: str, cache_path: str):
+        images = user["images"]
+        if not images:
+            return
+        url = images[0]["url"]
+        path = os.path.join(
+            storage_path, f"user-icon-{hashlib.sha1(url.encode()).hexdigest()[:16]}.png"
+        )
+        # the copy from the previous launch is shown right away and revalidated in the background
+        self.user_icon = deferred_widgets().FitImage(
+            source=path if os.path.exists(path) else "",
+            size_hint=(None, None),
+            pos_hint={"left_x": 0.0, "center_y": 0.5},
+            radius=["36dp", "36dp", "36dp", "36dp"],
+            fit_mode="contain",
+            size=("64dp", "64dp"),
+        )
+        self.leading_buttons.add_widget(self.user_icon)
+        threading.Thread(
+            target=self.refresh_user_icon, args=(url, path, cache_path), daemon=True
+        ).start()
+
+    def refresh_user_icon(self, url: str, path: str, cache_path: str):
+        # the network modules are only needed here, and imported off the main thread
+        from requests import RequestException
+
+        if platform == "android":
+            from cache import ImageStore
+            from utils import download_from_url
+        else:
+            from src.cache import ImageStore
+            from src.utils import download_from_url
+
+        image_store = ImageStore(cache_path)
+        try:
+            validators = image_store.get(url) if os.path.exists(path) else {}
+            validators = download_from_url(url, path, **validators)
+            if validators is not None:
+                image_store.set(url, **validators)
+        except (RequestException, OSError) as e:
+            Logger.warning(f"Couldn't refresh user icon: {e}")
+            return
+        finally:
+            image_store.close()
+        if validators is not None:
+            Clock.schedule_once(lambda dt: self.show_user_icon(path))
+
+    def show_user_icon(self, path: str):
+        if self.user_icon.source == path:
+            self.user_icon.reload()
+        else:
+            self.user_icon.source = path
+
 
 class MainScreen(MDScreen):
     def __init__(self, **kwargs):
@@ -248,29 +233,48 @@ class MainScreen(MDScreen):
 
         self.command_layout.add_widget(PlaylistCreatorLabel(text="Command"))
 
-        self.command_button = PlaylistCreatorTextButton(text="Select command to execute...")
-        menu_items = [
-            {
-                "text": "Get Top",
-                "on_release": lambda x="Get Top": self.command_menu_callback(x),
-            },
-            {
-                "text": "Get Recommendations",
-                "on_release": lambda x="Get Recommendations": self.command_menu_callback(x),
-            },
-            {
-                "text": "Blend With Friend",
-                "on_release": lambda x="Blend With Friend": self.command_menu_callback(x),
-            },
-        ]
-        self.command_menu = MDDropdownMenu(
-            caller=self.command_button, items=menu_items, hor_growth="left"
+        # enabled once the Spotify client has been loaded in the background
+        self.command_button = PlaylistCreatorTextButton(
+            text="Select command to execute...", disabled=True
         )
-        self.command_button.bind(on_release=lambda x: self.command_menu.open())
+        self.command_menu = None
+        self.command_button.bind(on_release=self.open_command_menu)
         self.command_layout.add_widget(self.command_button)
 
-        self.playlist_creator = self.app.playlist_creator
-        self.username = self.playlist_creator.sp.me()["id"]
+        self.playlist_creator = None
+        self.username = None
+        self.job_runner = JobRunner()
+
+    def on_playlist_creator_ready(self, playlist_creator):
+        self.playlist_creator = playlist_creator
+        self.username = playlist_creator.current_user["id"]
+        self.command_button.disabled = False
+        for ch in self.command_button.children:
+            ch.disabled = False
+        self.app_top_bar.show_user(
+            playlist_creator.current_user, self.app.storage_path, playlist_creator.cache.path
+        )
+
+    def open_command_menu(self, instance):
+        if self.command_menu is None:
+            menu_items = [
+                {
+                    "text": "Get Top",
+                    "on_release": lambda x="Get Top": self.command_menu_callback(x),
+                },
+                {
+                    "text": "Get Recommendations",
+                    "on_release": lambda x="Get Recommendations": self.command_menu_callback(x),
+                },
+                {
+                    "text": "Blend With Friend",
+                    "on_release": lambda x="Blend With Friend": self.command_menu_callback(x),
+                },
+            ]
+            self.command_menu = deferred_widgets().MDDropdownMenu(
+                caller=self.command_button, items=menu_items, hor_growth="left"
+            )
+        self.command_menu.open()
 
     def command_menu_callback(self, text):
         self.command_button.children[0].text = text
@@ -302,14 +306,14 @@ class MainScreen(MDScreen):
                 "on_release": lambda x="Long term (~1 year)": self.time_range_callback(x),
             },
         ]
-        self.time_range_menu = MDDropdownMenu(
+        self.time_range_menu = deferred_widgets().MDDropdownMenu(
             caller=self.time_range_button, items=time_range_items, hor_growth="left"
         )
         self.time_range_button.bind(on_release=lambda x: self.time_range_menu.open())
         self.time_range_layout.add_widget(self.time_range_button)
 
         self.limit_layout.add_widget(PlaylistCreatorLabel(text="Amount of tracks"))
-        self.limit = PlaylistCreatorInput(
+        self.limit = deferred_widgets().PlaylistCreatorInput(
             hint_text="How many tracks a playlist should contain",
             text="50",
             input_filter="int",
@@ -328,11 +332,13 @@ class MainScreen(MDScreen):
                 size_hint=(0.3, 1),
                 size_hint_min_x="200dp",
             )
-            self.seed_type_tracks = CheckItem(
+            self.seed_type_tracks = deferred_widgets().CheckItem(
                 text="tracks", active=True, id="top_tracks", group="seed_type"
             )
             check_items_layout.add_widget(self.seed_type_tracks)
-            self.seed_type_artists = CheckItem(text="artists", id="top_artists", group="seed_type")
+            self.seed_type_artists = deferred_widgets().CheckItem(
+                text="artists", id="top_artists", group="seed_type"
+            )
             check_items_layout.add_widget(self.seed_type_artists)
             self.playlist_layout.add_widget(check_items_layout)
 
@@ -348,14 +354,14 @@ class MainScreen(MDScreen):
                 }
                 for item in playlists
             ]
-            self.playlist_menu = MDDropdownMenu(
+            self.playlist_menu = deferred_widgets().MDDropdownMenu(
                 caller=self.playlist_button, items=menu_items, hor_growth="left"
             )
             self.playlist_button.bind(on_release=lambda x: self.playlist_menu.open())
             self.playlist_layout.add_widget(self.playlist_button)
 
             self.friend_layout.add_widget(PlaylistCreatorLabel(text="Friend's username"))
-            self.friend_input = PlaylistCreatorInput(
+            self.friend_input = deferred_widgets().PlaylistCreatorInput(
                 hint_text="Spotify username of the user playlist of which should be blended with"
             )
             self.friend_ok_button = MDIconButton(
@@ -426,29 +432,59 @@ class MainScreen(MDScreen):
 
     def get_playlists(self, username: str):
         playlists = self.playlist_creator.get_user_playlists(username)
-        return [p["name"] for p in playlists["items"]]
+        return [p["name"] for p in playlists]
 
     def generate_playlist(self, instance):
+        if self.job_runner.busy:
+            return
         time_range = self.time_range_button.children[0].text
+        command = self.command_button.children[0].text
+        params = {
+            "command": command,
+            "time_range": time_range,
+            "limit": int(self.limit.text),
+            "seed_type_tracks": command == "Get Recommendations" and self.seed_type_tracks.active,
+        }
+        if command == "Blend With Friend":
+            params["friend"] = self.friend_input.text
+            params["friends_playlist_name"] = self.friend_playlist_button.children[0].text
+            params["my_playlist_name"] = self.playlist_button.children[0].text
+        self.set_generating(True)
+        self.job_runner.run(
+            lambda progress: self._generate_playlist(progress=progress, **params),
+            on_progress=self.show_progress,
+            on_done=self.on_playlist_generated,
+            on_error=self.on_generate_error,
+        )
+
+    def _generate_playlist(
+        self,
+        command,
+        time_range,
+        limit,
+        seed_type_tracks,
+        progress,
+        friend=None,
+        friends_playlist_name=None,
+        my_playlist_name=None,
+    ):
+        # runs on the job runner thread: no widget access here, only progress callbacks
         time_range_normalized = time_range.split(" (")[0].lower().replace(" ", "_")
         playlist, playlist_name = None, None
-        match self.command_button.children[0].text:
+        match command:
             case "Get Top":
-                top_tracks_ids = self.playlist_creator.get_top_tracks(
-                    time_range_normalized, int(self.limit.text)
-                )
                 playlist_name = f"top_{time_range_normalized}_{str(date.today())}"
                 playlist = self.playlist_creator.get_todays_top_playlist(
                     self.username, playlist_name
                 )
                 if not playlist:
+                    progress("Fetching top tracks...")
+                    top_tracks_ids = self.playlist_creator.get_top_tracks(
+                        time_range_normalized, limit
+                    )
                     if len(top_tracks_ids) == 0:
-                        PlaylistCreatorSnackbar(
-                            text="Can't generate playlist!",
-                            sup_text="Not enough data exists for provided criteria.\nTry to change time range or listen more.",
-                            background_color=self.theme_cls.onErrorContainerColor,
-                        ).open()
                         raise UserInputError(f"No top tracks found for {time_range_normalized}")
+                    progress("Creating playlist...")
                     playlist = self.playlist_creator.create_playlist(
                         playlist_name,
                         f"Generated by PlaylistCreator for {time_range}",
@@ -457,39 +493,39 @@ class MainScreen(MDScreen):
 
             case "Get Recommendations":
                 description = "Generated by PlaylistCreator based on "
-                if self.seed_type_tracks.active:
+                if seed_type_tracks:
+                    progress("Fetching top tracks...")
                     top_tracks_ids = self.playlist_creator.get_top_tracks(
-                        time_range_normalized, int(self.limit.text)
+                        time_range_normalized, limit
                     )
                     if len(top_tracks_ids) < 5:
-                        PlaylistCreatorSnackbar(
-                            text="Can't generate playlist!",
-                            sup_text="Not enough data exists for provided criteria.\nTry to change time range or listen more.",
-                            background_color=self.theme_cls.onErrorContainerColor,
-                        ).open()
                         raise UserInputError(
                             f"Not enough top tracks found for {time_range_normalized}"
                         )
                     seed_tracks_ids = random.choices(top_tracks_ids, k=5)
+                    progress("Fetching recommendations...")
                     result = self.playlist_creator.get_recommendations(
-                        seed_tracks=seed_tracks_ids, limit=int(self.limit.text), country="SE"
+                        seed_tracks=seed_tracks_ids, limit=limit, country="SE"
                     )
-                    seed_tracks = [self.playlist_creator.sp.track(i) for i in seed_tracks_ids]
+                    seed_tracks = self.playlist_creator.get_tracks(seed_tracks_ids)
                     artist_tracks = [
                         f"{t['artists'][0]['name']} - {t['name']}" for t in seed_tracks
                     ]
                     description += f"tracks from my {time_range} top: {', '.join(artist_tracks)}"
                 else:
+                    progress("Fetching top artists...")
                     top_artists_ids = self.playlist_creator.get_top_artists(
                         time_range_normalized, 5
                     )
+                    progress("Fetching recommendations...")
                     result = self.playlist_creator.get_recommendations(
-                        seed_artists=top_artists_ids, limit=int(self.limit.text), country="SE"
+                        seed_artists=top_artists_ids, limit=limit, country="SE"
                     )
-                    seed_artists = [self.playlist_creator.sp.artist(i) for i in top_artists_ids]
+                    seed_artists = self.playlist_creator.get_artists(top_artists_ids)
                     description += f"my {time_range} top artists: {', '.join([a['name'] for a in seed_artists])}"
                 tracks_ids = [t["id"] for t in result["tracks"]]
                 playlist_name = f"recommendations_{str(date.today())}"
+                progress("Creating playlist...")
                 playlist = self.playlist_creator.create_playlist(
                     playlist_name,
                     description,
@@ -497,42 +533,68 @@ class MainScreen(MDScreen):
                 )
 
             case "Blend With Friend":
+                progress("Blending playlists...")
                 playlist = self.playlist_creator.make_blend(
-                    self.friend_input.text,
-                    self.friend_playlist_button.children[0].text,
-                    self.playlist_button.children[0].text,
-                    int(self.limit.text),
+                    friend, friends_playlist_name, my_playlist_name, limit
                 )
                 playlist_name = playlist["name"]
 
-        if playlist:
-            if self.app.platform == "android":
-                PlaylistCreatorSnackbar(
-                    text="Playlist is generated",
-                    sup_text=f"Try out now: {playlist_name}!",
-                    background_color=self.theme_cls.onPrimaryContainerColor,
-                    action_text="Play",
-                    on_release=self.app.play_playlist(playlist["id"]),
-                ).open()
-            else:
-                PlaylistCreatorSnackbar(
-                    text="Playlist is generated",
-                    sup_text=f"Try out now: {playlist_name}!",
-                    background_color=self.theme_cls.onPrimaryContainerColor,
-                ).open()
-        else:
-            PlaylistCreatorSnackbar(
-                text="Something went wrong :(",
-                sup_text="Error report is sent to developer",
-                background_color=self.theme_cls.onErrorContainerColor,
-            ).open()
+        if not playlist:
             raise PlaylistCreatorError(
                 "Couldn't create playlist",
                 username=self.username,
-                command=self.command_button.children[0].text,
+                command=command,
                 time_range=time_range,
                 playlist_name=playlist_name,
             )
+        return playlist
+
+    def set_generating(self, generating):
+        self.generate_button.disabled = generating
+        for ch in self.generate_button.children:
+            ch.disabled = generating
+        if not generating:
+            self.show_progress("Generate playlist")
+
+    def show_progress(self, text):
+        self.generate_button.get_ids()["generate_text"].text = text
+
+    def on_playlist_generated(self, playlist):
+        self.set_generating(False)
+        self.app.write_metrics()
+        playlist_name = playlist["name"]
+        if self.app.platform == "android":
+            deferred_widgets().PlaylistCreatorSnackbar(
+                text="Playlist is generated",
+                sup_text=f"Try out now: {playlist_name}!",
+                background_color=self.theme_cls.onPrimaryContainerColor,
+                action_text="Play",
+                on_release=self.app.play_playlist(playlist["id"]),
+            ).open()
+        else:
+            deferred_widgets().PlaylistCreatorSnackbar(
+                text="Playlist is generated",
+                sup_text=f"Try out now: {playlist_name}!",
+                background_color=self.theme_cls.onPrimaryContainerColor,
+            ).open()
+
+    def on_generate_error(self, error):
+        self.set_generating(False)
+        self.app.write_metrics()
+        if isinstance(error, UserInputError):
+            deferred_widgets().PlaylistCreatorSnackbar(
+                text="Can't generate playlist!",
+                sup_text="Not enough data exists for provided criteria.\nTry to change time range or listen more.",
+                background_color=self.theme_cls.onErrorContainerColor,
+            ).open()
+        else:
+            deferred_widgets().PlaylistCreatorSnackbar(
+                text="Something went wrong :(",
+                sup_text="Error report is sent to developer",
+                background_color=self.theme_cls.onErrorContainerColor,
+            ).open()
+        # re-raised on the main thread so that the app exception handler still sees it
+        raise error
 
     def time_range_callback(self, text):
         self.time_range_button.children[0].text = text
@@ -551,7 +613,7 @@ class MainScreen(MDScreen):
                 self.playlist_creator.sp.user(friend)
             except Exception:
                 Logger.error(f"User {friend} seems to not exist")
-                PlaylistCreatorSnackbar(
+                deferred_widgets().PlaylistCreatorSnackbar(
                     text="User seems to not exist",
                     sup_text=f"User with id {friend} is not found. Check your input and try again.",
                     background_color=self.theme_cls.onErrorContainerColor,
@@ -571,7 +633,7 @@ class MainScreen(MDScreen):
                     }
                     for item in playlists
                 ]
-                self.friend_playlist_menu = MDDropdownMenu(
+                self.friend_playlist_menu = deferred_widgets().MDDropdownMenu(
                     caller=self.friend_playlist_button, items=menu_items, hor_growth="left"
                 )
                 self.friend_playlist_button.bind(
@@ -1,3 +1,9 @@
+import time
+
+# taken before any other import, so that the startup report covers them too
+STARTED = time.perf_counter()
+
+import json
 import os
 import random
 import sys
@@ -9,35 +15,45 @@ kivy.require("2.3.0")
 from dotenv import load_dotenv
 from kivy.base import ExceptionHandler, ExceptionManager
 from kivy.config import Config
+from kivy.core.window import Window
 from kivy.logger import Logger
 from kivy.utils import platform
 from kivymd.app import MDApp
 
+# the Spotify client is imported by PlaylistCreatorApp.load_playlist_creator, off the main thread
 if platform == "android":
     sys.path.append(os.getcwd())
-    from components import MainScreen
+    from components import JobRunner, MainScreen
     from exceptions import PlaylistCreatorError, UserInputError
-    from playlist_creator import PlaylistCreator
-    from utils import send_crash_report
+    from metrics import METRICS_ENV, RequestMetrics
 else:
-    from src.components import MainScreen
+    from src.components import JobRunner, MainScreen
     from src.exceptions import PlaylistCreatorError, UserInputError
-    from src.playlist_creator import PlaylistCreator
-    from src.utils import send_crash_report
+    from src.metrics import METRICS_ENV, RequestMetrics
 
+IMPORTED = time.perf_counter()
 os.environ["KIVY_LOG_MODE"] = "MIXED"
 
 
+def report_crash(e):
+    # utils brings in requests and the email modules, which only a crash needs
+    if platform == "android":
+        from utils import send_crash_report
+    else:
+        from src.utils import send_crash_report
+    send_crash_report("", e)
+
+
 class E(ExceptionHandler):
     def handle_exception(self, inst):
         Logger.exception(f"Caught {type(inst)}", exc_info=True)
         if isinstance(inst, UserInputError):
             return ExceptionManager.PASS
         elif isinstance(inst, PlaylistCreatorError):
-            send_crash_report("", inst)
+            report_crash(inst)
             return ExceptionManager.PASS
         else:
-            send_crash_report("", inst)
+            report_crash(inst)
             return ExceptionManager.RAISE
 
 
@@ -124,18 +140,77 @@ class PlaylistCreatorApp(MDApp):
             load_dotenv(os.path.join(os.getcwd(), "android.env"))
 
         Logger.debug(f"Env vars: {os.environ.items()}")
-        self.playlist_creator = PlaylistCreator()
-        self.username = self.playlist_creator.sp.me()["id"]
+        self.metrics = RequestMetrics() if os.environ.get(METRICS_ENV) else None
         self.platform = platform
-        return MainScreen()
+        # the first screen is drawn while the client authenticates and loads the profile
+        self.playlist_creator = None
+        self.username = None
+        self.startup_timings = {"imports": round(IMPORTED - STARTED, 3)}
+        Window.bind(on_flip=self.on_first_frame)
+        self.loader = JobRunner()
+        self.loader.run(
+            self.load_playlist_creator,
+            on_progress=lambda text: None,
+            on_done=self.on_playlist_creator_loaded,
+            on_error=self.on_playlist_creator_error,
+        )
+        root = MainScreen()
+        self.mark_startup("build")
+        return root
+
+    def mark_startup(self, stage):
+        self.startup_timings[stage] = round(time.perf_counter() - STARTED, 3)
+
+    def report_startup(self):
+        # complete once the first frame is on screen and the app has become interactive
+        if {"first_frame", "profile"} <= self.startup_timings.keys():
+            Logger.info(f"Startup: seconds since launch {json.dumps(self.startup_timings)}")
+
+    def on_first_frame(self, *args):
+        Window.unbind(on_flip=self.on_first_frame)
+        self.mark_startup("first_frame")
+        self.report_startup()
+
+    def load_playlist_creator(self, progress):
+        # runs on the loader thread, so importing spotipy and requests doesn't delay drawing
+        if platform == "android":
+            from playlist_creator import PlaylistCreator
+        else:
+            from src.playlist_creator import PlaylistCreator
+        playlist_creator = PlaylistCreator(metrics=self.metrics)
+        self.mark_startup("client")
+        # the access token is fetched, refreshed or authorized with this first request
+        user = playlist_creator.current_user
+        self.mark_startup("profile")
+        Logger.info(f"Logged in to Spotify as {user['id']}")
+        return playlist_creator
+
+    def on_playlist_creator_loaded(self, playlist_creator):
+        self.playlist_creator = playlist_creator
+        self.username = playlist_creator.current_user["id"]
+        self.root.on_playlist_creator_ready(playlist_creator)
+        self.report_startup()
+
+    def on_playlist_creator_error(self, error):
+        # re-raised on the main thread for the exception handler, as when it failed in build
+        raise error
 
     def on_start(self):
         def on_start(*args):
             self.root.md_bg_color = self.theme_cls.backgroundColor
 
     def on_pause(self):
+        self.write_metrics()
         return True
 
+    def on_stop(self):
+        self.write_metrics()
+
+    def write_metrics(self):
+        # a relative path is kept next to the logs, the app's cwd isn't writable on android
+        if self.metrics:
+            self.metrics.write(os.path.join(self.storage_path, os.environ[METRICS_ENV]))
+
     def set_theme(self, theme):
         self.theme_cls.theme_style = theme
         self.theme_cls.primary_palette = random.choice(self.all_colors)
@@ -0,0 +1,133 @@
+import bisect
+import json
+import os
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+METRICS_ENV = "SPOTIFY_METRICS"
+# upper bounds in seconds, the last bucket (+Inf) takes everything slower
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+THROTTLED = "throttled"
+SERVER_ERROR = "server_error"
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class EndpointMetrics:
+    def __init__(self, buckets: tuple):
+        self.responses = Counter()
+        self.retries = Counter()
+        self.bytes = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * (len(buckets) + 1)
+
+    @property
+    def calls(self) -> int:
+        return sum(self.responses.values())
+
+
+class RequestMetrics:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._endpoints = defaultdict(lambda: EndpointMetrics(self.buckets))
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint: str, status: int, seconds: float, size: int, retries: int = 0):
+        # one response as the client got it; retries are attempts urllib3 made before it
+        with self._lock:
+            metrics = self._endpoints[endpoint]
+            metrics.responses[status] += 1
+            metrics.bytes += size
+            metrics.latency_sum += seconds
+            metrics.latency_buckets[bisect.bisect_left(self.buckets, seconds)] += 1
+            if retries:
+                metrics.retries[SERVER_ERROR] += retries
+            if status == 429:
+                metrics.retries[THROTTLED] += 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                endpoint: {
+                    "calls": m.calls,
+                    "responses": {str(status): n for status, n in sorted(m.responses.items())},
+                    "retries": dict(m.retries),
+                    "bytes": m.bytes,
+                    "latency": {
+                        "sum": round(m.latency_sum, 6),
+                        "buckets": dict(
+                            zip([str(b) for b in self.buckets] + ["+Inf"], m.latency_buckets)
+                        ),
+                    },
+                }
+                for endpoint, m in sorted(self._endpoints.items())
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self) -> str:
+        lines = []
+
+        def family(name: str, kind: str, help: str):
+            lines.append(f"# HELP spotify_api_{name} {help}")
+            lines.append(f"# TYPE spotify_api_{name} {kind}")
+
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            family("requests_total", "counter", "Spotify API responses by endpoint and status")
+            for endpoint, m in endpoints:
+                for status, n in sorted(m.responses.items()):
+                    lines.append(
+                        f'spotify_api_requests_total{{endpoint="{_label(endpoint)}",'
+                        f'status="{status}"}} {n}'
+                    )
+            family("retries_total", "counter", "Spotify API requests retried, by reason")
+            for endpoint, m in endpoints:
+                for reason, n in sorted(m.retries.items()):
+                    lines.append(
+                        f'spotify_api_retries_total{{endpoint="{_label(endpoint)}",'
+                        f'reason="{reason}"}} {n}'
+                    )
+            family("response_bytes_total", "counter", "Spotify API response body bytes")
+            for endpoint, m in endpoints:
+                lines.append(
+                    f'spotify_api_response_bytes_total{{endpoint="{_label(endpoint)}"}} {m.bytes}'
+                )
+            family("request_duration_seconds", "histogram", "Spotify API response latency")
+            for endpoint, m in endpoints:
+                label = f'endpoint="{_label(endpoint)}"'
+                cumulative = 0
+                for bound, n in zip([str(b) for b in self.buckets] + ["+Inf"], m.latency_buckets):
+                    cumulative += n
+                    lines.append(
+                        f'spotify_api_request_duration_seconds_bucket{{{label},le="{bound}"}} '
+                        f"{cumulative}"
+                    )
+                lines.append(f"spotify_api_request_duration_seconds_sum{{{label}}} {m.latency_sum}")
+                lines.append(f"spotify_api_request_duration_seconds_count{{{label}}} {m.calls}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        # .prom files are meant for the node exporter textfile collector, anything else gets JSON
+        data = self.to_prometheus() if path.endswith(".prom") else self.to_json()
+        # replaced in one go so that a collector never reads a half written file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+@contextmanager
+def collect_metrics(path: str | None):
+    # yields None when no path is given. The file is written on failures too, they are when the
+    # numbers matter most
+    metrics = RequestMetrics() if path else None
+    try:
+        yield metrics
+    finally:
+        if metrics:
+            metrics.write(path)
@@ -1,19 +1,160 @@
 import functools
 import json
+import logging
+import os
+import re
+import threading
+from collections import defaultdict
 from datetime import date
+from difflib import SequenceMatcher
 from multiprocessing.pool import ThreadPool
 from typing import List, Union
 
 import spotipy
 from ytmusicapi import YTMusic
 
+if __package__:
+    from src.cache import (
+        LikedTracksStore,
+        MatchStore,
+        PlaylistContentStore,
+        ResponseCache,
+        default_cache_path,
+    )
+    from src.exceptions import MigrationError
+    from src.metrics import METRICS_ENV, RequestMetrics, collect_metrics
+    from src.spotify_client import (
+        PLAYLIST_ITEMS_LIMIT,
+        PlaylistContents,
+        PlaylistIndex,
+        SpotifyClient,
+    )
+else:
+    from cache import (
+        LikedTracksStore,
+        MatchStore,
+        PlaylistContentStore,
+        ResponseCache,
+        default_cache_path,
+    )
+    from exceptions import MigrationError
+    from metrics import METRICS_ENV, RequestMetrics, collect_metrics
+    from spotify_client import PLAYLIST_ITEMS_LIMIT, PlaylistContents, PlaylistIndex, SpotifyClient
+
+SAVED_TRACKS_LIMIT = 50
+SEARCH_CHECKPOINT_SIZE = 50
+CHECKPOINT_FILE = 'migration_checkpoint.json'
+MAX_WORKERS = 4
+FUZZY_MATCH_RATIO = 0.9
+# bracketed notes, featured artists and "- Remastered 2011"-like suffixes
+_TITLE_NOISE = re.compile(
+    r'\(.*?\)|\[.*?\]|\b(feat|ft)\..*$| - .*\b(remaster|version|edit|mix)\w*.*$')
+
+
+def _batched(items: list, size: int) -> List[list]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _normalize(text: str) -> str:
+    text = _TITLE_NOISE.sub('', text.lower())
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text).split())
+
+
+def _match_key(artist: str, track: str) -> str:
+    return f'{_normalize(artist)}|{_normalize(track)}'
+
+
+class TrackMatchIndex:
+    def __init__(self, sp_tracks: List[dict]):
+        self._exact = {}
+        self._by_artist = defaultdict(list)
+        for t in sp_tracks:
+            title = _normalize(t['name'])
+            for a in t['artists']:
+                artist = _normalize(a['name'])
+                self._exact.setdefault(f'{artist}|{title}', t['id'])
+                self._by_artist[artist].append((title, t['id']))
+
+    def match(self, artist: str, track: str) -> Union[str, None]:
+        artist, title = _normalize(artist), _normalize(track)
+        track_id = self._exact.get(f'{artist}|{title}')
+        if track_id:
+            return track_id
+        best_ratio, best_id = 0.0, None
+        for candidate, candidate_id in self._by_artist.get(artist, []):
+            ratio = SequenceMatcher(None, title, candidate).ratio()
+            if ratio > best_ratio:
+                best_ratio, best_id = ratio, candidate_id
+        return best_id if best_ratio >= FUZZY_MATCH_RATIO else None
+
+
+class MigrationJournal:
+    def __init__(self, path: str = CHECKPOINT_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self.stages = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.stages = json.load(f)
+
+    def _save(self):
+        # written to a temporary file first so that a crash never leaves a truncated journal
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.stages, f)
+        os.replace(tmp_path, self.path)
+
+    def stage(self, name: str) -> dict:
+        with self._lock:
+            return dict(self.stages.get(name, {}))
+
+    def record(self, name: str, **values):
+        with self._lock:
+            self.stages.setdefault(name, {}).update(values)
+            self._save()
+
+    def append(self, name: str, key: str, value):
+        with self._lock:
+            self.stages.setdefault(name, {}).setdefault(key, []).append(value)
+            self._save()
+
+    def run(self, name: str, func, *args, **kwargs):
+        stage = self.stage(name)
+        if stage.get('done'):
+            logging.info(f'Stage {name} is already done, skipping it')
+            return stage['result']
+        result = func(*args, **kwargs)
+        self.record(name, done=True, result=result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self.stages = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
 
 class Yt2SpMigrator:
-    def __init__(self, headers_file: str, sp_config: str):
-        self.ytmusic = YTMusic(headers_file)
-        with open(sp_config, "r") as f:
-            config = json.load(f)
-        self.sp = spotipy.Spotify(auth_manager=spotipy.SpotifyOAuth(**config))
+    def __init__(self, headers_file: str, sp_config: str, cache_path: str = None,
+                 sp: SpotifyClient = None, ytmusic: YTMusic = None,
+                 metrics: RequestMetrics = None):
+        # sp and ytmusic replace the clients built from the config files, e.g. with fakes
+        self.ytmusic = ytmusic or YTMusic(headers_file)
+        if sp is None:
+            with open(sp_config, "r") as f:
+                config = json.load(f)
+            sp = SpotifyClient(auth_manager=spotipy.SpotifyOAuth(**config),
+                               cache=ResponseCache(cache_path or default_cache_path()),
+                               cache_namespace=config.get('username', ''),
+                               metrics=metrics)
+        self.sp = sp
+        self.cache = sp.cache
+        self.namespace = sp.cache_namespace
+        self.playlist_index = PlaylistIndex(self.sp)
+        self.match_store = MatchStore(self.cache.path)
+        self.liked_store = LikedTracksStore(self.cache.path)
+        self.playlist_contents = PlaylistContents(self.sp, PlaylistContentStore(self.cache.path))
+        self._local_index = None
 
     def _unpack_search_result(self, result: dict) -> Union[str, None]:
         tracks = result['tracks']['items']
@@ -22,94 +163,183 @@ class Yt2SpMigrator:
     def _unpack_track(self, result: dict) -> str:
         return result['track']['id']
 
+    def _get_local_index(self) -> TrackMatchIndex:
+        if self._local_index is None:
+            self._local_index = TrackMatchIndex([t['track'] for t in self._get_sp_liked_tracks()])
+        return self._local_index
+
     def _get_sp_track_ids(self, yt_playlist: List[dict]) -> list:
         track_maps = [dict(artist=t['artists'][0]['name'], track=t['title']) for t in yt_playlist]
-        queries = [f'track:{t["track"]} artist:{t["artist"]}' for t in track_maps]
-        with ThreadPool() as p:
-            results = p.map(functools.partial(self.sp.search, type='track'), queries)
-            track_list = p.map(self._unpack_search_result, results)
-        while None in track_list:
-            track_list.remove(None)
-        return track_list
+        keys = [_match_key(t['artist'], t['track']) for t in track_maps]
+        # previous runs' matches first, then the user's own library, and search only what's left
+        matches = self.match_store.get_many(keys)
+        unresolved = {k: t for k, t in zip(keys, track_maps) if k not in matches}
+        if unresolved:
+            index = self._get_local_index()
+            new_matches = {k: index.match(t['artist'], t['track']) for k, t in unresolved.items()}
+            to_search = [k for k, track_id in new_matches.items() if not track_id]
+            queries = [f'track:{unresolved[k]["track"]} artist:{unresolved[k]["artist"]}'
+                       for k in to_search]
+            self.match_store.set_many({k: v for k, v in new_matches.items() if v})
+            matches.update(new_matches)
+            # searched in chunks and stored as they go, so a crash only loses the last chunk
+            with ThreadPool(MAX_WORKERS) as p:
+                for i in range(0, len(to_search), SEARCH_CHECKPOINT_SIZE):
+                    chunk = to_search[i:i + SEARCH_CHECKPOINT_SIZE]
+                    results = p.map(functools.partial(self.sp.search, type='track'),
+                                    queries[i:i + SEARCH_CHECKPOINT_SIZE])
+                    found = dict(zip(chunk, map(self._unpack_search_result, results)))
+                    self.match_store.set_many(found)
+                    matches.update(found)
+        return [matches[k] for k in keys if matches[k]]
 
     def _non_duplicated_append(self, list1: List[str], list2: List[str]) -> list:
         in_first = set(list1)
-        in_second = set(list2)
-        in_second_but_not_in_first = in_second - in_first
-        return list(in_second_but_not_in_first)
+        return [t for t in dict.fromkeys(list2) if t not in in_first]
 
     def get_yt_playlist_by_name(self, playlist_name: str) -> list:
         library = self.ytmusic.get_library_playlists()
         playlist_id = [p['playlistId'] for p in library if p['title'] == playlist_name][0]
         return self.ytmusic.get_playlist(playlist_id, 200)['tracks']
 
-    def _get_sp_liked_tracks(self):
-        liked_tracks = self.sp.current_user_saved_tracks(limit=50)
-        result_list = liked_tracks['items']
-        i = 1
-        while liked_tracks['next']:
-            liked_tracks = self.sp.current_user_saved_tracks(limit=50, offset=50 * i)
-            result_list.extend(liked_tracks['items'])
-            i += 1
-        return result_list
-
-    def like_yt_tracks_on_sp(self, yt_playlist: list) -> list:
-        track_ids_to_add = self._get_sp_track_ids(yt_playlist)
-        liked_tracks = self._get_sp_liked_tracks()
-        with ThreadPool() as p:
-            liked_ids = p.map(self._unpack_track, liked_tracks)
+    def _trim_liked_item(self, item: dict) -> dict:
+        track = item['track']
+        return dict(added_at=item['added_at'],
+                    track=dict(id=track['id'],
+                               name=track['name'],
+                               artists=[dict(name=a['name']) for a in track['artists']]))
+
+    def _get_liked_tracks_page(self, offset: int) -> list:
+        return self.sp.current_user_saved_tracks(limit=SAVED_TRACKS_LIMIT, offset=offset)['items']
+
+    def _sync_sp_liked_tracks(self) -> list:
+        known = self.liked_store.load(self.namespace)
+        known_keys = {(i['track']['id'], i['added_at']) for i in known}
+        # saved tracks come newest first: read pages until reaching a like that is already known
+        new_items, offset, reached_known = [], 0, False
+        while not reached_known:
+            page = self.sp.current_user_saved_tracks(limit=SAVED_TRACKS_LIMIT, offset=offset)
+            for item in page['items']:
+                if (item['track']['id'], item['added_at']) in known_keys:
+                    reached_known = True
+                    break
+                new_items.append(self._trim_liked_item(item))
+            if not page['next']:
+                break
+            offset += SAVED_TRACKS_LIMIT
+        new_ids = {i['track']['id'] for i in new_items}
+        expected = len(new_items) + len([i for i in known if i['track']['id'] not in new_ids])
+        if expected == page['total']:
+            self.liked_store.update(self.namespace, new_items)
+            return new_items
+        # something was unliked in the meantime, so the snapshot is rebuilt from scratch
+        offsets = range(0, page['total'], SAVED_TRACKS_LIMIT)
+        with ThreadPool(MAX_WORKERS) as p:
+            items = [self._trim_liked_item(i)
+                     for page_items in p.imap(self._get_liked_tracks_page, offsets)
+                     for i in page_items]
+        self.liked_store.update(self.namespace, items, replace=True)
+        return [i for i in items if (i['track']['id'], i['added_at']) not in known_keys]
+
+    def _get_sp_liked_tracks(self) -> list:
+        self._sync_sp_liked_tracks()
+        return self.liked_store.load(self.namespace)
+
+    def _save_tracks_batch(self, track_ids: List[str]) -> bool:
+        try:
+            self.sp.current_user_saved_tracks_add(track_ids)
+        except spotipy.SpotifyException as e:
+            logging.error(f'Failed to save batch of {len(track_ids)} tracks: {e}')
+            return False
+        return True
+
+    def _save_indexed_batch(self, indexed_batch: tuple) -> tuple:
+        i, batch = indexed_batch
+        return i, self._save_tracks_batch(batch)
+
+    def like_yt_tracks_on_sp(self, yt_playlist: list, journal: MigrationJournal = None) -> list:
+        stage = journal.stage('like') if journal else {}
+        track_ids = stage.get('track_ids')
+        if track_ids is None:
+            track_ids_to_add = self._get_sp_track_ids(yt_playlist)
+            liked_ids = [self._unpack_track(t) for t in self._get_sp_liked_tracks()]
             track_ids = self._non_duplicated_append(liked_ids, track_ids_to_add)
-            # spotipy module takes track_id as list and spotify itself has a 50 tracks per request restriction.
-            # It seems better to use multi-threading.
-            p.map(self.sp.current_user_saved_tracks_add, [[t] for t in track_ids])
-        after_adding = self._get_sp_liked_tracks()
-        assert len(after_adding) > len(liked_tracks)
-        return after_adding
+            if journal:
+                journal.record('like', track_ids=track_ids)
+        # spotify accepts up to 50 track ids per request to the saved tracks endpoint
+        batches = _batched(track_ids, SAVED_TRACKS_LIMIT)
+        written = set(stage.get('written', []))
+        pending = [(i, b) for i, b in enumerate(batches) if i not in written]
+        failed = []
+        with ThreadPool(MAX_WORKERS) as p:
+            for i, saved in p.imap_unordered(self._save_indexed_batch, pending):
+                logging.info(f'Batch {i + 1}/{len(batches)} of {len(batches[i])} tracks: '
+                             f'{"saved" if saved else "failed"}')
+                if not saved:
+                    failed.append(i)
+                elif journal:
+                    journal.append('like', 'written', i)
+        # the stage must not be checkpointed as done, a resumed run retries only these batches
+        if failed:
+            raise MigrationError(f'{len(failed)} of {len(batches)} batches of liked tracks '
+                                 f'failed to save')
+        # the post-write check only downloads the likes added since the snapshot was last synced
+        liked_now = {self._unpack_track(i) for i in self._get_sp_liked_tracks()}
+        saved_ids = [t for t in track_ids if t in liked_now]
+        if len(saved_ids) < len(track_ids):
+            logging.warning(f'{len(track_ids) - len(saved_ids)} of {len(track_ids)} tracks '
+                            f'are missing from liked tracks')
+        return saved_ids
+
+    def _add_to_playlist(self, playlist_id: str, track_ids: List[str]):
+        # spotify allows adding max 100 tracks per request
+        for batch in _batched(track_ids, PLAYLIST_ITEMS_LIMIT):
+            result = self.sp.playlist_add_items(playlist_id, batch)
+            self.playlist_index.update(playlist_id, result['snapshot_id'])
 
     def save_track_ids_to_playlist(self, track_ids: List[str], name: str) -> str:
         user_id = self.sp.current_user()['id']
         playlist_id = self.get_sp_playlist_by_name(name)
         if not playlist_id:
-            playlist_id = self.sp.user_playlist_create(user=user_id,
-                                                       name=name,
-                                                       public=False)['id']
-            self.sp.playlist_add_items(playlist_id, track_ids)
+            playlist = self.sp.user_playlist_create(user=user_id, name=name, public=False)
+            self.playlist_index.add(None, playlist)
+            playlist_id = playlist['id']
+            self._add_to_playlist(playlist_id, track_ids)
             return playlist_id
-        pl_items = self.sp.playlist_items(playlist_id)['items']
-        playlist_content = [p['id'] for p in pl_items]
-        to_add = [t for t in track_ids if t not in playlist_content]
+        playlist_content = self.playlist_contents.track_ids(playlist_id)
+        to_add = self._non_duplicated_append(playlist_content, track_ids)
         if len(to_add) > 0:
-            self.sp.playlist_add_items(playlist_id, to_add)
+            self._add_to_playlist(playlist_id, to_add)
         return playlist_id
 
     def get_sp_playlist_by_name(self, p_name: str) -> Union[str, None]:
-        playlists = self.sp.current_user_playlists()['items']
-        playlist_id = [p['id'] for p in playlists if p['name'] == p_name]
-        if len(playlist_id) == 0:
-            return None
-        return playlist_id[0]
+        playlist = self.playlist_index.get(None, p_name)
+        return playlist['id'] if playlist else None
 
     def merge_playlists(self, playlist1_id: str, playlist2_id: str, p_name: str) -> str:
-        playlist1 = self.sp.playlist_items(playlist1_id)['items']
-        playlist2 = self.sp.playlist_items(playlist2_id)['items']
-        with ThreadPool() as p:
-            p1_ids = p.map(self._unpack_track, playlist1)
-            p2_ids = p.map(self._unpack_track, playlist2)
+        p1_ids = self.playlist_contents.track_ids(playlist1_id)
+        p2_ids = self.playlist_contents.track_ids(playlist2_id)
         to_add = self._non_duplicated_append(p1_ids, p2_ids)
-        new_list = self.save_track_ids_to_playlist(p1_ids, p_name)  # spotify allows adding max 100 tracks per request
-        with ThreadPool() as p:
-            p.map(functools.partial(self.sp.playlist_add_items, new_list), [[t] for t in to_add])
-        return new_list
+        # saved as one list, so that a resumed merge only writes what the playlist still lacks
+        return self.save_track_ids_to_playlist(p1_ids + to_add, p_name)
 
 
-if __name__ == '__main__':
-    migrator = Yt2SpMigrator("headers.json", "config.json")
-    liked_tracks = migrator.like_yt_tracks_on_sp(migrator.get_yt_playlist_by_name('Your Likes'))
-    yt_2020_tracks = migrator.get_yt_playlist_by_name('My 2020 Year in Review')
-    track_ids = migrator._get_sp_track_ids(yt_2020_tracks)
-    name = f'YT migration {date.today()}'
-    top2020_playlist = migrator.save_track_ids_to_playlist(track_ids, name)
+def migrate(migrator: Yt2SpMigrator, journal: MigrationJournal) -> str:
+    journal.run('like', lambda: migrator.like_yt_tracks_on_sp(
+        migrator.get_yt_playlist_by_name('Your Likes'), journal))
+    track_ids = journal.run('match_2020', lambda: migrator._get_sp_track_ids(
+        migrator.get_yt_playlist_by_name('My 2020 Year in Review')))
+    # pinned in the journal so that a run resumed on another day writes to the same playlist
+    name = journal.run('name_2020', lambda: f'YT migration {date.today()}')
+    yt_top = journal.run('save_2020', migrator.save_track_ids_to_playlist, track_ids, name)
     sp_top = migrator.get_sp_playlist_by_name('Your Top Songs 2020')
-    yt_top = migrator.get_sp_playlist_by_name(f'YT migration {date.today()}')
-    united_2020 = migrator.merge_playlists(sp_top, yt_top, 'United 2020 top')
-    assert len(migrator.sp.playlist_items(united_2020)['items']) > 100
+    return journal.run('merge_2020', migrator.merge_playlists, sp_top, yt_top, 'United 2020 top')
+
+
+if __name__ == '__main__':
+    with collect_metrics(os.environ.get(METRICS_ENV)) as metrics:
+        migrator = Yt2SpMigrator("headers.json", "config.json", metrics=metrics)
+        journal = MigrationJournal()
+        united_2020 = migrate(migrator, journal)
+        assert len(migrator.sp.playlist_items(united_2020)['items']) > 100
+        journal.clear()
@@ -1,81 +1,186 @@
 import argparse
+import functools
+import itertools
+import json
 import os
 import random
+import sys
+import threading
+import time
 from datetime import date
-from urllib.parse import urlparse
+from multiprocessing.pool import ThreadPool
 
-import spotipy
+if __package__:
+    from src.cache import PlaylistContentStore, ResponseCache, TokenStore, default_cache_path
+    from src.exceptions import PlaylistCreatorError, UserInputError
+    from src.metrics import METRICS_ENV, collect_metrics
+    from src.spotify_client import (
+        ACCOUNT_ENDPOINTS,
+        PLAYLIST_ITEMS_LIMIT,
+        PlaylistContents,
+        PlaylistIndex,
+        SpotifyAuth,
+        SpotifyClient,
+        TokenCacheHandler,
+    )
+else:
+    from cache import PlaylistContentStore, ResponseCache, TokenStore, default_cache_path
+    from exceptions import PlaylistCreatorError, UserInputError
+    from metrics import METRICS_ENV, collect_metrics
+    from spotify_client import (
+        ACCOUNT_ENDPOINTS,
+        PLAYLIST_ITEMS_LIMIT,
+        PlaylistContents,
+        PlaylistIndex,
+        SpotifyAuth,
+        SpotifyClient,
+        TokenCacheHandler,
+    )
 
 scopes = "playlist-modify-public playlist-modify-private user-top-read user-read-private"
+MAX_WORKERS = 8
+TIME_RANGES = ("short_term", "medium_term", "long_term")
+COMMANDS = ("get_top", "get_recommendations", "blend_with_friend", "snapshot_all")
+BATCH_WORKERS = 4
+TOP_ITEMS_LIMIT = 50
+# maximum amount of ids the bulk metadata endpoints accept per request
+METADATA_LIMITS = {"tracks": 50, "artists": 50, "albums": 20}
+
+
+def weighted_interleave(track_lists: list, weights: list):
+    # smooth weighted round robin: every turn each source earns its weight and the richest
+    # one gives away the total, so picks are spread evenly in proportion to the weights
+    iterators = [iter(t) for t in track_lists]
+    credits = [0.0] * len(track_lists)
+    active = list(range(len(track_lists)))
+    seen = set()
+    while active:
+        total = sum(weights[i] for i in active)
+        for i in active:
+            credits[i] += weights[i]
+        chosen = max(active, key=lambda i: credits[i])
+        credits[chosen] -= total
+        for id in iterators[chosen]:
+            if id not in seen:
+                seen.add(id)
+                yield id
+                break
+        else:
+            active.remove(chosen)
+
+
+class BlendSource:
+    def __init__(self, user=None, playlist_name=None, time_range=None, weight=1.0, limit=50):
+        # either a playlist of user (None for the current user) or the current user's top
+        self.user = user
+        self.playlist_name = playlist_name
+        self.time_range = time_range
+        self.weight = weight
+        self.limit = limit
+
+    def describe(self, me: str):
+        if self.playlist_name:
+            return f"{self.user or me}'s {self.playlist_name}"
+        return f"{me}'s {self.time_range} top"
 
 
 class PlaylistCreator:
-    def __init__(self, username=None):
-        url_parts = urlparse(os.environ["SPOTIPY_REDIRECT_URI"])
-        server = spotipy.oauth2.start_local_http_server(url_parts.port)
-        server.server_activate()
-        self.sp = spotipy.Spotify(
-            auth_manager=spotipy.SpotifyPKCE(
-                client_id=os.environ["SPOTIPY_CLIENT_ID"],
-                redirect_uri=os.environ["SPOTIPY_REDIRECT_URI"],
-                scope=scopes,
-                requests_timeout=60,
-            )
+    def __init__(self, username=None, cache_path=None, sp=None, metrics=None):
+        # sp replaces the authenticated client, e.g. with one talking to benchmarks.fake_spotify
+        self.sp = sp or self._build_client(username, cache_path, metrics)
+        self.cache = self.sp.cache
+        self._current_user = None
+        self._current_user_lock = threading.Lock()
+        self.playlist_index = PlaylistIndex(self.sp)
+        self.playlist_contents = PlaylistContents(self.sp, PlaylistContentStore(self.cache.path))
+        self._metadata = {kind: {} for kind in METADATA_LIMITS}
+        auth_manager = self.sp.auth_manager
+        if isinstance(auth_manager, SpotifyAuth) and not auth_manager.has_token():
+            # the first request logs in, maybe as another account than the cached reads are for
+            self.invalidate_current_user()
+
+    @staticmethod
+    def _build_client(username=None, cache_path=None, metrics=None, cache=None):
+        # one auth manager per account, its token is stored next to the cached responses
+        cache = cache or ResponseCache(cache_path or default_cache_path())
+        namespace = username or ""
+        auth_manager = SpotifyAuth(
+            client_id=os.environ["SPOTIPY_CLIENT_ID"],
+            redirect_uri=os.environ["SPOTIPY_REDIRECT_URI"],
+            scope=scopes,
+            requests_timeout=60,
+            cache_handler=TokenCacheHandler(TokenStore(cache.path), namespace),
+        )
+        return SpotifyClient(
+            auth_manager=auth_manager, cache=cache, cache_namespace=namespace, metrics=metrics
         )
-        if username:
-            self.sp = spotipy.Spotify(
-                auth_manager=spotipy.SpotifyPKCE(
-                    client_id=os.environ["SPOTIPY_CLIENT_ID"],
-                    redirect_uri=os.environ["SPOTIPY_REDIRECT_URI"],
-                    scope=scopes,
-                    username=username,
-                    requests_timeout=60,
-                )
-            )
 
-    def get_top_tracks(self, range: str, limit=50, offset=0, accumulated_results=None):
-        if accumulated_results is None:
-            accumulated_results = []
+    @property
+    def current_user(self):
+        with self._current_user_lock:
+            if self._current_user is None:
+                self._current_user = self.sp.me()
+            return self._current_user
 
-        batch_limit = min(50, limit)
-        results = self.sp.current_user_top_tracks(
-            time_range=range, limit=batch_limit, offset=offset
-        )
-        if not results or not results["items"]:
-            return accumulated_results
+    def invalidate_current_user(self):
+        # the profile only changes when a different account logs in, and so do the other reads
+        # of "me" the response cache keeps
+        with self._current_user_lock:
+            self._current_user = None
+        self.cache.invalidate(*ACCOUNT_ENDPOINTS)
 
-        accumulated_results.extend([i["id"] for i in results["items"]])
-        if len(results["items"]) < batch_limit:
-            return accumulated_results
+    def _iter_top_items(self, fetch, range: str, limit: int, offset: int):
+        # pages are requested only as the consumer advances, so stopping early saves requests
+        end = offset + limit
+        while offset < end:
+            batch_limit = min(TOP_ITEMS_LIMIT, end - offset)
+            results = fetch(time_range=range, limit=batch_limit, offset=offset)
+            if not results or not results["items"]:
+                return
+            for item in results["items"]:
+                yield item["id"]
+            if len(results["items"]) < batch_limit:
+                return
+            offset += batch_limit
 
-        if limit > batch_limit:
-            return self.get_top_tracks(
-                range, limit - batch_limit, offset + batch_limit, accumulated_results
-            )
+    def iter_top_tracks(self, range: str, limit=50, offset=0):
+        return self._iter_top_items(self.sp.current_user_top_tracks, range, limit, offset)
 
-        return accumulated_results
+    def iter_top_artists(self, range: str, limit=20, offset=0):
+        return self._iter_top_items(self.sp.current_user_top_artists, range, limit, offset)
 
-    def get_top_artists(self, range: str, limit=20, offset=0, accumulated_results=None):
-        if accumulated_results is None:
-            accumulated_results = []
+    def get_top_tracks(self, range: str, limit=50, offset=0):
+        return list(self.iter_top_tracks(range, limit, offset))
 
-        batch_limit = min(20, limit)
-        results = self.sp.current_user_top_artists(
-            time_range=range, limit=batch_limit, offset=offset
-        )
-        if not results or not results["items"]:
-            return accumulated_results
+    def get_top_artists(self, range: str, limit=20, offset=0):
+        return list(self.iter_top_artists(range, limit, offset))
 
-        accumulated_results.extend([i["id"] for i in results["items"]])
-        if len(results["items"]) < batch_limit:
-            return accumulated_results
+    def _get_metadata_batch(self, kind: str, ids: list):
+        return getattr(self.sp, kind)(ids)[kind]
 
-        if limit > batch_limit:
-            return self.get_top_artists(
-                range, limit - batch_limit, offset + batch_limit, accumulated_results
-            )
+    def get_metadata(self, kind: str, ids: list):
+        known = self._metadata[kind]
+        missing = [i for i in dict.fromkeys(ids) if i not in known]
+        batches = [
+            missing[i : i + METADATA_LIMITS[kind]]
+            for i in range(0, len(missing), METADATA_LIMITS[kind])
+        ]
+        if batches:
+            with ThreadPool(min(MAX_WORKERS, len(batches))) as p:
+                results = p.map(functools.partial(self._get_metadata_batch, kind), batches)
+            for item in itertools.chain.from_iterable(results):
+                if item:
+                    known[item["id"]] = item
+        return [known.get(i) for i in ids]
 
-        return accumulated_results
+    def get_tracks(self, ids: list):
+        return self.get_metadata("tracks", ids)
+
+    def get_artists(self, ids: list):
+        return self.get_metadata("artists", ids)
+
+    def get_albums(self, ids: list):
+        return self.get_metadata("albums", ids)
 
     def get_todays_top_playlist(self, username: str, playlist_name: str):
         top_playlist = self.get_playlist_by_name(username, playlist_name)
@@ -83,6 +188,24 @@ class PlaylistCreator:
             return top_playlist
         return None
 
+    def create_top_playlist(self, time_range: str, track_ids_list: list):
+        return self.create_playlist(
+            top_playlist_name(time_range), f"Generated by yt2sp for {time_range}", track_ids_list
+        )
+
+    def snapshot_top(self, limit=50, time_ranges=TIME_RANGES) -> list:
+        # today's top playlist of every range: the playlist index is listed once, the top tracks
+        # of the missing ranges are fetched concurrently and the playlists created in range order
+        existing = {p["name"]: p for p in self.get_user_playlists(self.current_user["id"])}
+        playlists = {r: existing.get(top_playlist_name(r)) for r in time_ranges}
+        missing = [r for r, playlist in playlists.items() if not playlist]
+        if missing:
+            with ThreadPool(len(missing)) as p:
+                track_lists = p.map(functools.partial(self.get_top_tracks, limit=limit), missing)
+            for time_range, track_ids in zip(missing, track_lists):
+                playlists[time_range] = self.create_top_playlist(time_range, track_ids)
+        return [playlists[r] for r in time_ranges]
+
     def get_recommendations(
         self, seed_artists=None, seed_genres=None, seed_tracks=None, limit=50, country=None
     ):
@@ -93,75 +216,50 @@ class PlaylistCreator:
         return results
 
     def create_playlist(self, name: str, description: str, track_ids_list: list):
-        user_id = self.sp.me()["id"]
+        user_id = self.current_user["id"]
         result = self.sp.user_playlist_create(user_id, name, description=description)
-        if len(track_ids_list) > 100:
-            for i in range(0, len(track_ids_list), 99):
-                self.sp.playlist_add_items(
-                    result["id"], track_ids_list[i : min(len(track_ids_list), i + 99)]
-                )
-        else:
-            self.sp.playlist_add_items(result["id"], track_ids_list)
+        self.playlist_index.add(user_id, result)
+        self.add_tracks_to_playlist(result["id"], track_ids_list)
         return result
 
+    def add_tracks_to_playlist(self, playlist_id: str, track_ids_list: list, position=0):
+        # Spotify rejects a position past the current end of the playlist, so chunks can't be
+        # in flight at the same time. An explicit position keeps the order deterministic.
+        # Failures are left to the session's 5xx and the scheduler's 429 retries.
+        for i in range(0, len(track_ids_list), PLAYLIST_ITEMS_LIMIT):
+            result = self.sp.playlist_add_items(
+                playlist_id, track_ids_list[i : i + PLAYLIST_ITEMS_LIMIT], position=position + i
+            )
+            self.playlist_index.update(playlist_id, result["snapshot_id"])
+
     def get_user_playlists(self, username: str):
-        return self.sp.user_playlists(username)
+        return self.playlist_index.playlists(username)
 
     def get_playlist_by_name(self, username: str, playlist_name: str):
-        playlists = self.get_user_playlists(username)
-        playlist = [p for p in playlists["items"] if p["name"] == playlist_name]
+        playlist = self.playlist_index.get(username, playlist_name)
         if not playlist:
             print(f"Couldn't find playlist {playlist_name} for user {username}")
             return None
-        return playlist[0]
+        return playlist
 
     def get_all_playlist_tracks(self, playlist_id: str):
-        def _get_playlist_tracks(self, playlist_id, offset, accumulated_results=None):
-            if accumulated_results is None:
-                accumulated_results = []
-
-            results = self.sp.playlist_items(
-                playlist_id,
-                offset=offset,
-                fields="items.track.id,total,next",
-                additional_types=["track"],
+        return self.playlist_contents.track_ids(playlist_id)
+
+    def _get_source_tracks(self, source: "BlendSource"):
+        if source.playlist_name:
+            playlist = self.get_playlist_by_name(
+                source.user or self.current_user["id"], source.playlist_name
             )
-            if not results or not results["items"]:
-                return accumulated_results
-
-            tracks_ids = [i["track"]["id"] for i in results["items"]]
-            accumulated_results.extend(tracks_ids)
-            if results["next"]:
-                return _get_playlist_tracks(self, results["total"], accumulated_results)
-            return accumulated_results
-
-        return _get_playlist_tracks(self, playlist_id, 0)
-
-    def get_unique_tracks(self, playlist_1, playlist_2):
-        pl1_tracks = self.get_all_playlist_tracks(playlist_1["id"])
-        pl2_tracks = self.get_all_playlist_tracks(playlist_2["id"])
-        common_tracks = [id for id in pl1_tracks if id in pl2_tracks]
-        i = 0
-        for id in common_tracks:
-            if i % 2 == 0:
-                pl1_tracks.remove(id)
-            else:
-                pl2_tracks.remove(id)
-            i += 1
-        return pl1_tracks, pl2_tracks
+            return self.get_all_playlist_tracks(playlist["id"]) if playlist else []
+        return self.get_top_tracks(source.time_range, source.limit)
 
-    def make_blend(
-        self, friend: str, friends_playlist_name: str, my_playlist_name: str, limit: int
-    ):
-        me = self.sp.me()["id"]
-        friends_playlist = self.get_playlist_by_name(friend, friends_playlist_name)
-        my_playlist = self.get_playlist_by_name(me, my_playlist_name)
-        friends_tracks, my_tracks = self.get_unique_tracks(friends_playlist, my_playlist)
-        amount = min(len(friends_tracks), len(my_tracks))
-        result_tracks = []
-        for i in range(0, amount):
-            result_tracks.append(friends_tracks[i])
-            result_tracks.append(my_tracks[i])
+    def make_group_blend(self, sources: list, limit: int):
+        me = self.current_user["id"]
+        with ThreadPool(min(MAX_WORKERS, len(sources))) as p:
+            track_lists = p.map(self._get_source_tracks, sources)
+        result_tracks = list(
+            itertools.islice(weighted_interleave(track_lists, [s.weight for s in sources]), limit)
+        )
         if len(result_tracks) < limit:
             recommendations = self.get_recommendations(
                 seed_tracks=result_tracks[0:3], limit=limit - len(result_tracks)
@@ -170,15 +268,159 @@ class PlaylistCreator:
             result_tracks.extend(tracks_ids)
         result_playlist = self.create_playlist(
             f"blend_{str(date.today())}_{random.randint(0, 100)}",
-            f"Generated by yt2sp based on {friend}'s {friends_playlist_name} and {me}'s {my_playlist_name}",
+            f"Generated by yt2sp based on {', '.join(s.describe(me) for s in sources)}",
             result_tracks[0:limit],
         )
         return result_playlist
 
+    def make_blend(
+        self, friend: str, friends_playlist_name: str, my_playlist_name: str, limit: int
+    ):
+        return self.make_group_blend(
+            [BlendSource(friend, friends_playlist_name), BlendSource(None, my_playlist_name)],
+            limit,
+        )
+
+
+def top_playlist_name(time_range: str) -> str:
+    return f"top_{time_range}_{str(date.today())}"
+
+
+def run_command(
+    playlist_creator: PlaylistCreator,
+    command: str,
+    time_range: str,
+    limit: int,
+    blend_sources: list = None,
+):
+    match command:
+        case "get_top":
+            top_playlist = playlist_creator.get_todays_top_playlist(
+                playlist_creator.current_user["id"], top_playlist_name(time_range)
+            )
+            if not top_playlist:
+                top_tracks_ids = playlist_creator.get_top_tracks(time_range, limit)
+                top_playlist = playlist_creator.create_top_playlist(time_range, top_tracks_ids)
+            return top_playlist
+        case "get_recommendations":
+            top_tracks_ids = playlist_creator.get_top_tracks(time_range, limit)
+            seed_tracks = random.choices(top_tracks_ids, k=5)
+            result = playlist_creator.get_recommendations(
+                seed_tracks=seed_tracks, limit=limit, country="SE"
+            )
+            tracks_ids = [t["id"] for t in result["tracks"]]
+            return playlist_creator.create_playlist(
+                f"recommendations_{str(date.today())}",
+                f"Generated by yt2sp based on 5 random tracks from my current {time_range} top",
+                tracks_ids,
+            )
+        case "blend_with_friend":
+            return playlist_creator.make_group_blend(blend_sources, limit)
+        case "snapshot_all":
+            return playlist_creator.snapshot_top(limit)
+
+
+def _as_list(value) -> list:
+    # a job file may give a single friend, playlist or weight without the list around it
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def make_blend_sources(friends=None, friends_playlists=None, my_playlist=None, weights=None):
+    friends, friends_playlists, weights = map(_as_list, (friends, friends_playlists, weights))
+    if len(friends) != len(friends_playlists):
+        raise UserInputError(
+            f"Got {len(friends)} friends and {len(friends_playlists)} friends' playlists, "
+            "expected one playlist per friend"
+        )
+    if weights and len(weights) != len(friends) + 1:
+        raise UserInputError(
+            f"Got {len(weights)} weights, expected one per friend's playlist and one for mine"
+        )
+    blend_sources = [
+        BlendSource(friend, playlist) for friend, playlist in zip(friends, friends_playlists)
+    ]
+    blend_sources.append(BlendSource(None, my_playlist))
+    for source, weight in zip(blend_sources, weights):
+        source.weight = float(weight)
+    return blend_sources
+
+
+def run_jobs(jobs: list, cache_path=None, metrics=None, workers=BATCH_WORKERS) -> dict:
+    # Accounts run in parallel and the jobs of one account in order on one client, so its token,
+    # profile and playlist index are fetched once. Every client shares the response cache, the
+    # request scheduler and the pooled connections.
+    cache = ResponseCache(cache_path or default_cache_path())
+    accounts = {}
+    for index, job in enumerate(jobs):
+        accounts.setdefault(job.get("username"), []).append((index, job))
+    results = [None] * len(jobs)
+
+    def run_account(username, account_jobs):
+        playlist_creator = None
+        for index, job in account_jobs:
+            result = {
+                "username": username,
+                "command": job["command"],
+                "time_range": job.get("time_range", "short_term"),
+                "limit": job.get("limit", 50),
+            }
+            started = time.perf_counter()
+            try:
+                # a malformed job fails on its own, like any other error in it
+                result["limit"] = int(result["limit"])
+                if playlist_creator is None:
+                    sp = PlaylistCreator._build_client(username, metrics=metrics, cache=cache)
+                    # a batch runs unattended, nobody would answer the browser
+                    if not sp.auth_manager.has_token():
+                        raise PlaylistCreatorError(
+                            "Not authenticated, run a command as this user once interactively",
+                            username,
+                            result["command"],
+                            result["time_range"],
+                        )
+                    playlist_creator = PlaylistCreator(sp=sp)
+                blend_sources = make_blend_sources(
+                    job.get("friend"),
+                    job.get("friends_playlist"),
+                    job.get("my_playlist"),
+                    job.get("weights"),
+                )
+                playlist = run_command(
+                    playlist_creator,
+                    result["command"],
+                    result["time_range"],
+                    result["limit"],
+                    blend_sources,
+                )
+                # snapshot_all makes a playlist per time range
+                playlists = playlist if isinstance(playlist, list) else [playlist]
+                result.update(
+                    status="ok",
+                    playlists=[p["name"] for p in playlists],
+                    playlist_ids=[p["id"] for p in playlists],
+                )
+            except Exception as e:
+                # one account failing doesn't stop the others
+                result.update(status="error", error=f"{type(e).__name__}: {e}")
+            result["seconds"] = round(time.perf_counter() - started, 3)
+            results[index] = result
+
+    started = time.perf_counter()
+    with ThreadPool(max(1, min(workers, len(accounts)))) as pool:
+        pool.starmap(run_account, accounts.items())
+    return {
+        "seconds": round(time.perf_counter() - started, 3),
+        "failed": sum(result["status"] == "error" for result in results),
+        "jobs": results,
+        "cache": cache.stats(),
+    }
+
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("command", choices=["get_top", "get_recommendations", "blend_with_friend"])
+    parser.add_argument("command", nargs="?", choices=COMMANDS)
     parser.add_argument(
         "-u", "--username", default=os.environ.get("USERNAME"), help="User to be logged in as"
     )
@@ -186,8 +428,8 @@ def main():
         "-r",
         "--time_range",
         default="short_term",
-        choices=["short_term", "medium_term", "long_term"],
-        help='Applicable for "get_top". Time range for picking top tracks',
+        choices=TIME_RANGES,
+        help='Applicable for "get_top". Time range for picking top tracks, "snapshot_all" makes all of them',
     )
     parser.add_argument(
         "-l", "--limit", default=50, help="Amount of tracks to have in final playlist"
@@ -195,51 +437,98 @@ def main():
     parser.add_argument(
         "-f",
         "--friend",
-        help='Applicable for "blend_with_friend". Username of the user blend with whom should be created',
+        action="append",
+        help='Applicable for "blend_with_friend". Username of the user blend with whom should be created. Repeat for a group blend',
     )
     parser.add_argument(
         "-fp",
         "--friends-playlist",
-        help='Applicable for "blend_with_friend". Name of friend playlist to blend with current user one',
+        action="append",
+        help='Applicable for "blend_with_friend". Name of friend playlist to blend with current user one. One per --friend',
     )
     parser.add_argument(
         "-mp",
         "--my-playlist",
         help='Applicable for "blend_with_friend". Name of current user playlist to blend with friend one',
     )
+    parser.add_argument(
+        "-w",
+        "--weights",
+        nargs="+",
+        type=float,
+        help='Applicable for "blend_with_friend". Share of each friend\'s playlist followed by my playlist, equal by default',
+    )
+    parser.add_argument(
+        "--jobs",
+        help="Run the jobs in this JSON file instead of one command: a list of objects with "
+        "username, command and optionally time_range, limit, friend, friends_playlist, "
+        "my_playlist and weights",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=BATCH_WORKERS,
+        help="Applicable for --jobs. Accounts to run at the same time",
+    )
+    parser.add_argument(
+        "--report", help="Applicable for --jobs. Write the per-job timing summary to this file"
+    )
+    parser.add_argument(
+        "--cache-stats", action="store_true", help="Print API response cache statistics on exit"
+    )
+    parser.add_argument(
+        "--metrics",
+        default=os.environ.get(METRICS_ENV),
+        help=f"Write per-endpoint API metrics to this file, as Prometheus text if it ends with "
+        f".prom and as JSON otherwise. Defaults to ${METRICS_ENV}",
+    )
     args = parser.parse_args()
-    playlist_creator = PlaylistCreator(username=args.username)
-    top_tracks_ids = playlist_creator.get_top_tracks(args.time_range, int(args.limit))
-
-    match args.command:
-        case "get_top":
-            playlist_name = f"top_{args.time_range}_{str(date.today())}"
-            top_playlist = playlist_creator.get_todays_top_playlist(
-                playlist_creator.sp.me()["id"], playlist_name
-            )
-            if not top_playlist:
-                top_playlist = playlist_creator.create_playlist(
-                    playlist_name, f"Generated by yt2sp for {args.time_range}", top_tracks_ids
+    if not args.command and not args.jobs:
+        parser.error("a command or --jobs is required")
+    if args.jobs:
+        with open(args.jobs) as f:
+            jobs = json.load(f)
+        # the command line options are the defaults of every job
+        defaults = {
+            "username": args.username,
+            "command": args.command,
+            "time_range": args.time_range,
+            "limit": args.limit,
+        }
+        jobs = [{**defaults, **job} for job in jobs]
+        unknown = {str(job["command"]) for job in jobs} - set(COMMANDS)
+        if unknown:
+            parser.error(f"unknown commands in {args.jobs}: {', '.join(sorted(unknown))}")
+        with collect_metrics(args.metrics) as metrics:
+            report = run_jobs(jobs, metrics=metrics, workers=args.workers)
+            for job in report["jobs"]:
+                print(
+                    f"{job['seconds']:>8.3f}s {job['status']:<5} {str(job['username']):<20} "
+                    f"{job['command']:<20} {job.get('error') or ', '.join(job['playlists'])}"
                 )
-            print(top_playlist)
-        case "get_recommendations":
-            seed_tracks = random.choices(top_tracks_ids, k=5)
-            result = playlist_creator.get_recommendations(
-                seed_tracks=seed_tracks, limit=int(args.limit), country="SE"
-            )
-            tracks_ids = [t["id"] for t in result["tracks"]]
-            recommendations_playlist = playlist_creator.create_playlist(
-                f"recommendations_{str(date.today())}",
-                f"Generated by yt2sp based on 5 random tracks from my current {args.time_range} top",
-                tracks_ids,
-            )
+            if args.report:
+                with open(args.report, "w") as f:
+                    json.dump(report, f, indent=2)
+            if args.cache_stats:
+                print(json.dumps(report["cache"], indent=2))
+        sys.exit(1 if report["failed"] else 0)
 
-            print(recommendations_playlist)
-        case "blend_with_friend":
-            blend_playlist = playlist_creator.make_blend(
-                args.friend, args.friends_playlist, args.my_playlist, int(args.limit)
+    try:
+        blend_sources = make_blend_sources(
+            args.friend, args.friends_playlist, args.my_playlist, args.weights
+        )
+    except UserInputError as e:
+        parser.error(str(e))
+    with collect_metrics(args.metrics) as metrics:
+        playlist_creator = PlaylistCreator(username=args.username, metrics=metrics)
+        try:
+            result = run_command(
+                playlist_creator, args.command, args.time_range, int(args.limit), blend_sources
             )
-            print(blend_playlist)
+            print(result)
+        finally:
+            if args.cache_stats:
+                print(json.dumps(playlist_creator.cache.stats(), indent=2))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,401 @@
+import functools
+import json
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import requests
+import spotipy
+import urllib3
+
+if __package__:
+    from src.utils import pooled_session
+else:
+    from utils import pooled_session
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# endpoints not listed here (recommendations, saved tracks checks, player) always hit the API
+CACHE_TTLS = {
+    "me": DAY,
+    "users/{id}": DAY,
+    "me/playlists": 5 * MINUTE,
+    "users/{id}/playlists": 5 * MINUTE,
+    "me/tracks": 5 * MINUTE,
+    "me/top/tracks": HOUR,
+    "me/top/artists": HOUR,
+    "tracks": 7 * DAY,
+    "tracks/{id}": 7 * DAY,
+    "artists": 7 * DAY,
+    "artists/{id}": 7 * DAY,
+    "albums": 7 * DAY,
+    "albums/{id}": 7 * DAY,
+    "search": DAY,
+}
+# playlist contents are left to PlaylistContents, which checks snapshot_id on every read
+# cached reads that a write request can make stale
+MUTABLE_ENDPOINTS = (
+    "me/playlists",
+    "users/{id}/playlists",
+    "me/tracks",
+)
+# cached reads that belong to whichever account is logged in
+ACCOUNT_ENDPOINTS = ("me", "me/playlists", "me/tracks", "me/top/tracks", "me/top/artists")
+ID_COLLECTIONS = ("users", "playlists", "tracks", "artists", "albums")
+# 429 is left out so that throttling reaches the scheduler instead of urllib3 retries
+RETRY_STATUSES = (500, 502, 503, 504)
+THROTTLE_RETRIES = 5
+DEFAULT_RETRY_AFTER = 1.0
+# the longest a request waits for a slot, not counting Retry-After pauses
+ACQUIRE_TIMEOUT = 5 * MINUTE
+PLAYLISTS_LIMIT = 50
+PLAYLIST_ITEMS_LIMIT = 100
+MAX_WORKERS = 8
+
+
+def endpoint_name(url: str) -> str:
+    path = url.split("/v1/", 1)[-1].split("?", 1)[0].strip("/")
+    segments = path.split("/")
+    if len(segments) > 1 and segments[0] in ID_COLLECTIONS:
+        segments[1] = "{id}"
+    return "/".join(segments)
+
+
+class RequestScheduler:
+    # Spotify doesn't publish its limit, so the rate starts low and adapts the same way as the
+    # concurrency: it grows while requests succeed and halves on every 429
+    def __init__(
+        self,
+        rate=10.0,
+        burst=20,
+        max_concurrency=8,
+        min_concurrency=1,
+        max_rate=100.0,
+        min_rate=1.0,
+        acquire_timeout=ACQUIRE_TIMEOUT,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = max_concurrency
+        self.acquire_timeout = acquire_timeout
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._in_flight = 0
+        self._successes = 0
+        self._blocked_until = 0.0
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._blocked_until:
+                    deadline = max(deadline, self._blocked_until + self.acquire_timeout)
+                    self._cond.wait(self._blocked_until - now)
+                elif self._in_flight >= self.concurrency:
+                    if now >= deadline:
+                        raise TimeoutError(
+                            f"no request slot freed up in {self.acquire_timeout} seconds"
+                        )
+                    self._cond.wait(deadline - now)
+                elif self._tokens < 1:
+                    self._cond.wait((1 - self._tokens) / self.rate)
+                else:
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    return
+
+    def release(self, retry_after=None):
+        with self._cond:
+            self._in_flight -= 1
+            # tokens earned so far are counted at the rate they were earned at
+            self._refill(time.monotonic())
+            if retry_after is None:
+                # additive increase: one more slot after a full window of successful requests,
+                # and one more request per second for each of them
+                self._successes += 1
+                if self._successes >= self.concurrency:
+                    self.rate = min(self.max_rate, self.rate + self.concurrency)
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                    self._successes = 0
+            else:
+                # multiplicative decrease and a pause for everyone until Retry-After has passed
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+                self._successes = 0
+                self._tokens = 0.0
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+            self._cond.notify_all()
+
+
+default_scheduler = RequestScheduler()
+
+
+def _retry_after(e: spotipy.SpotifyException):
+    # None unless Spotify really answered 429. spotipy reports urllib3 running out of 5xx retries
+    # as a 429 too, but without a response and so with no headers at all
+    if e.http_status != 429 or not e.headers:
+        return None
+    try:
+        return float(e.headers.get("Retry-After", DEFAULT_RETRY_AFTER))
+    except ValueError:
+        return DEFAULT_RETRY_AFTER
+
+
+class SpotifyClient(spotipy.Spotify):
+    def __init__(
+        self, *args, cache=None, cache_namespace="", scheduler=None, metrics=None, **kwargs
+    ):
+        kwargs.setdefault("status_forcelist", RETRY_STATUSES)
+        # set first, spotipy builds the session sized after it from its constructor
+        self.scheduler = scheduler or default_scheduler
+        super().__init__(*args, **kwargs)
+        self.cache = cache
+        self.cache_namespace = cache_namespace
+        self.metrics = metrics
+        if metrics is not None and isinstance(self._session, requests.Session):
+            self._session.hooks["response"].append(self._observe_response)
+
+    def _observe_response(self, response, *args, **kwargs):
+        # urllib3 keeps the attempts it retried on the raw response it finally returned
+        retries = getattr(response.raw, "retries", None)
+        self.metrics.observe(
+            endpoint_name(response.url),
+            response.status_code,
+            response.elapsed.total_seconds(),
+            len(response.content),
+            len(retries.history) if retries else 0,
+        )
+
+    def _build_session(self):
+        # same as spotipy's session, except urllib3 must not sleep on Retry-After by itself.
+        # Clients with the same retry policy share keep-alive connections, as many as the
+        # scheduler lets be in flight at once.
+        retry = urllib3.Retry(
+            total=self.retries,
+            connect=None,
+            read=False,
+            allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+            status=self.status_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.status_forcelist,
+            respect_retry_after_header=False,
+        )
+        pool_size = self.scheduler.max_concurrency
+        key = (
+            "spotify",
+            self.retries,
+            self.status_retries,
+            self.backoff_factor,
+            tuple(self.status_forcelist or ()),
+            pool_size,
+        )
+        self._session = pooled_session(key, retry, pool_size)
+
+    def _internal_call(self, method, url, payload, params):
+        if self.cache is None:
+            return self._scheduled_call(method, url, payload, params)
+        if method != "GET":
+            self.cache.invalidate(*MUTABLE_ENDPOINTS)
+            return self._scheduled_call(method, url, payload, params)
+
+        endpoint = endpoint_name(url)
+        ttl = CACHE_TTLS.get(endpoint)
+        if not ttl:
+            return self._scheduled_call(method, url, payload, params)
+        key = json.dumps(
+            [self.cache_namespace, url.removeprefix(self.prefix), params], sort_keys=True
+        )
+        results = self.cache.get(endpoint, key)
+        if results is None:
+            results = self._scheduled_call(method, url, payload, params)
+            if results is not None:
+                self.cache.set(endpoint, key, results, ttl)
+        return results
+
+    def _scheduled_call(self, method, url, payload, params):
+        for attempt in range(THROTTLE_RETRIES + 1):
+            self.scheduler.acquire()
+            retry_after = None
+            try:
+                # spotipy pops content_type out of params, so every attempt gets its own copy
+                return super()._internal_call(method, url, payload, dict(params))
+            except spotipy.SpotifyException as e:
+                retry_after = _retry_after(e)
+                if retry_after is None or attempt == THROTTLE_RETRIES:
+                    raise
+            finally:
+                # connection errors and failed token refreshes give the slot back as well
+                self.scheduler.release(retry_after)
+
+
+class TokenCacheHandler(spotipy.CacheHandler):
+    # tokens are kept in a TokenStore, in the cache database every run and the app open anyway,
+    # and in memory so that requests don't read them back from disk
+    def __init__(self, store, namespace: str = ""):
+        self.store = store
+        self.namespace = namespace
+        self._token_info = None
+        self._lock = threading.Lock()
+
+    def get_cached_token(self):
+        with self._lock:
+            if self._token_info is None:
+                # a token spotipy left in its .cache file spares the first run the browser
+                self._token_info = (
+                    self.store.get(self.namespace)
+                    or spotipy.CacheFileHandler(username=self.namespace or None).get_cached_token()
+                )
+            return self._token_info
+
+    def save_token_to_cache(self, token_info):
+        with self._lock:
+            self._token_info = token_info
+            self.store.set(self.namespace, token_info)
+
+
+class SpotifyAuth(spotipy.SpotifyPKCE):
+    # spotipy only starts the local redirect server and opens the browser when it has no token
+    # it can use or refresh. Threads that find the token expired wait for one refresh instead of
+    # each spending the refresh token.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._token_lock = threading.Lock()
+
+    def get_access_token(self, code=None, check_cache=True):
+        with self._token_lock:
+            return super().get_access_token(code, check_cache)
+
+    def has_token(self) -> bool:
+        # a token it can use or refresh, i.e. getting one doesn't need the browser. Unlike
+        # validate_token it doesn't refresh an expired token on the spot.
+        token_info = self.cache_handler.get_cached_token()
+        if not token_info or "scope" not in token_info:
+            return False
+        if not self._is_scope_subset(self.scope, token_info["scope"]):
+            return False
+        return "refresh_token" in token_info or not self.is_token_expired(token_info)
+
+
+def _snapshots(playlists) -> list:
+    return [(p["id"], p["snapshot_id"]) for p in playlists]
+
+
+class PlaylistIndex:
+    def __init__(self, sp: spotipy.Spotify):
+        self.sp = sp
+        # per user, playlists by id in listing order, and the first listed playlist of each name
+        self._playlists = {}
+        self._by_name = {}
+        self._lock = threading.Lock()
+
+    def _get_page(self, user, offset: int):
+        # user=None stands for the logged in user, whose private playlists are listed too
+        if user is None:
+            return self.sp.current_user_playlists(limit=PLAYLISTS_LIMIT, offset=offset)
+        return self.sp.user_playlists(user, limit=PLAYLISTS_LIMIT, offset=offset)
+
+    def _list_all(self, user, first_page: dict) -> list:
+        playlists = list(first_page["items"])
+        offsets = range(PLAYLISTS_LIMIT, first_page["total"], PLAYLISTS_LIMIT)
+        if offsets:
+            with ThreadPool(min(MAX_WORKERS, len(offsets))) as p:
+                for page in p.imap(functools.partial(self._get_page, user), offsets):
+                    playlists.extend(page["items"] if page else [])
+        return playlists
+
+    def refresh(self, user=None):
+        # a rename or an edit can be on any page, so every page is listed. A playlist whose
+        # snapshot_id is the stored one hasn't changed, and if none has, the index is left as is.
+        first_page = self._get_page(user, 0)
+        if not first_page:
+            return
+        playlists = self._list_all(user, first_page)
+        with self._lock:
+            known = self._playlists.get(user, {}).values()
+            if _snapshots(playlists) == _snapshots(known):
+                return
+        by_name = {}
+        for playlist in playlists:
+            by_name.setdefault(playlist["name"], playlist)
+        with self._lock:
+            self._playlists[user] = {p["id"]: p for p in playlists}
+            self._by_name[user] = by_name
+
+    def playlists(self, user=None) -> list:
+        self.refresh(user)
+        return list(self._by_name.get(user, {}).values())
+
+    def get(self, user, name: str):
+        playlist = self._by_name.get(user, {}).get(name)
+        if playlist is None:
+            self.refresh(user)
+            playlist = self._by_name.get(user, {}).get(name)
+        return playlist
+
+    def add(self, user, playlist: dict):
+        # a new playlist is listed first, the same as Spotify lists it
+        with self._lock:
+            if user in self._playlists:
+                self._playlists[user] = {playlist["id"]: playlist, **self._playlists[user]}
+                self._by_name[user][playlist["name"]] = playlist
+
+    def update(self, playlist_id: str, snapshot_id: str):
+        # the snapshot a write returned, so that the index's own writes don't look like changes
+        with self._lock:
+            for playlists in self._playlists.values():
+                if playlist_id in playlists:
+                    playlists[playlist_id]["snapshot_id"] = snapshot_id
+
+
+class PlaylistContents:
+    def __init__(self, sp: spotipy.Spotify, store):
+        self.sp = sp
+        self.store = store
+
+    def _get_page(self, playlist_id: str, offset: int):
+        results = self.sp.playlist_items(
+            playlist_id,
+            limit=PLAYLIST_ITEMS_LIMIT,
+            offset=offset,
+            fields="items.track.id,total",
+            additional_types=["track"],
+        )
+        if not results:
+            return [], 0
+        # local files and removed tracks come back with an empty track object
+        tracks_ids = [i["track"]["id"] for i in results["items"] if i["track"]]
+        return tracks_ids, results["total"]
+
+    def _fetch_track_ids(self, playlist_id: str) -> list:
+        tracks_ids, total = self._get_page(playlist_id, 0)
+        offsets = range(PLAYLIST_ITEMS_LIMIT, total, PLAYLIST_ITEMS_LIMIT)
+        if not offsets:
+            return tracks_ids
+        # imap keeps pages in playlist order while up to MAX_WORKERS of them are in flight
+        with ThreadPool(min(MAX_WORKERS, len(offsets))) as p:
+            pages = p.imap(functools.partial(self._get_page, playlist_id), offsets)
+            for page_tracks_ids, _ in pages:
+                tracks_ids.extend(page_tracks_ids)
+        return tracks_ids
+
+    def track_ids(self, playlist_id: str) -> list:
+        # a single-field playlist request tells whether the stored track list is still valid
+        snapshot_id = self.sp.playlist(playlist_id, fields="snapshot_id")["snapshot_id"]
+        tracks_ids = self.store.get(playlist_id, snapshot_id)
+        if tracks_ids is None:
+            tracks_ids = self._fetch_track_ids(playlist_id)
+            self.store.set(playlist_id, snapshot_id, tracks_ids)
+        return tracks_ids
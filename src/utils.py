@@ -6,6 +6,7 @@ import platform
 import shutil
 import smtplib
 import socket
+import threading
 from email import encoders
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
@@ -13,6 +14,32 @@ from email.mime.text import MIMEText
 
 import requests
 
+POOL_SIZE = 8
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 30
+_adapters = {}
+_adapters_lock = threading.Lock()
+
+
+class SharedAdapter(requests.adapters.HTTPAdapter):
+    def close(self):
+        # the pool outlives the sessions using it, spotipy closes its session when collected
+        pass
+
+
+def pooled_session(key="default", max_retries=0, pool_size=POOL_SIZE) -> requests.Session:
+    # sessions are cheap, the keep-alive connections live in the adapter, so every session
+    # made for the same key shares one pool of up to pool_size connections per host
+    with _adapters_lock:
+        adapter = _adapters.get(key)
+        if adapter is None:
+            adapter = SharedAdapter(pool_maxsize=pool_size, max_retries=max_retries)
+            _adapters[key] = adapter
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 
 def send_email(address, subject, text, attachment_path=None):
     msg = MIMEMultipart()
@@ -68,7 +95,27 @@ def send_crash_report(func, e=None):
     send_email("helgamogish@gmail.com", "Crash report", text, archive_kivy_logs())
 
 
-def download_from_url(url: str, dest_path: str):
-    response = requests.get(url)
-    with open(dest_path, "wb") as f:
-        f.write(response.content)
+def download_from_url(url: str, dest_path: str, etag=None, last_modified=None):
+    # with the validators of the copy at dest_path it is only downloaded again if it has
+    # changed; returns the new validators, or None when the copy is still current
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    with pooled_session().get(
+        url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT
+    ) as response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        # streamed into a temporary file, so a cut off download never replaces a good copy
+        tmp_path = f"{dest_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+        os.replace(tmp_path, dest_path)
+        return {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
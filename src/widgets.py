@@ -0,0 +1,102 @@
+# widgets that aren't part of the first screen, components imports this module on first use
+from kivy.core.window import Window
+from kivy.properties import BooleanProperty, StringProperty
+from kivy.utils import platform
+from kivymd.uix.boxlayout import MDBoxLayout
+from kivymd.uix.fitimage import FitImage  # noqa: F401
+from kivymd.uix.menu import MDDropdownMenu  # noqa: F401
+from kivymd.uix.selectioncontrol.selectioncontrol import MDCheckbox
+from kivymd.uix.snackbar.snackbar import (
+    MDSnackbar,
+    MDSnackbarActionButton,
+    MDSnackbarActionButtonText,
+    MDSnackbarButtonContainer,
+    MDSnackbarSupportingText,
+    MDSnackbarText,
+)
+from kivymd.uix.textfield import MDTextField
+
+if platform == "android":
+    from components import PlaylistCreatorLabel
+else:
+    from src.components import PlaylistCreatorLabel
+
+
+class PlaylistCreatorSnackbar(MDSnackbar):
+    def __init__(self, *args, **kwargs):
+        text = kwargs["text"]
+        del kwargs["text"]
+        sup_text = kwargs["sup_text"]
+        del kwargs["sup_text"]
+        action_text = kwargs.get("action_text")
+        if action_text:
+            del kwargs["action_text"]
+        on_release = kwargs.get("on_release")
+        if on_release:
+            del kwargs["on_release"]
+        if action_text and on_release:
+            super().__init__(
+                MDSnackbarText(text=text),
+                MDSnackbarSupportingText(text=sup_text),
+                MDSnackbarButtonContainer(
+                    MDSnackbarActionButton(
+                        MDSnackbarActionButtonText(text=action_text),
+                        on_release=lambda x: on_release(),
+                    ),
+                    pos_hint={"center_y": 0.5},
+                ),
+                orientation="horizontal",
+                *args,
+                **kwargs,
+            )
+        else:
+            super().__init__(
+                MDSnackbarText(text=text),
+                MDSnackbarSupportingText(text=sup_text),
+                *args,
+                **kwargs,
+            )
+        self.duration = 7
+        self.style = "elevated"
+        self.pos_hint = {"center_x": 0.5, "center_y": 0.15}
+        self.size_hint_x = 0.7
+
+
+class PlaylistCreatorInput(MDTextField):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.multiline = False
+        self.pos_hint = {"center_x": 0.5, "center_y": 0.5}
+        if not kwargs.get("size_hint_x"):
+            self.size_hint_x = 0.6
+        self.size_hint_min_x = 50
+
+    def on_touch_down(self, touch):
+        Window.softinput_mode = "pan"
+        super().on_touch_down(touch)
+
+
+class CheckItem(MDBoxLayout):
+    text = StringProperty()
+    group = StringProperty()
+    id = StringProperty()
+    active = BooleanProperty(False)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.orientation = "horizontal"
+        self.pos_hint = {"center_y": 0.5, "right_x": 1}
+        self.spacing = "12dp"
+        self.padding = "12dp"
+
+        self.checkbox = MDCheckbox(
+            group=self.group, active=self.active, pos_hint=self.pos_hint, id=self.id
+        )
+        self.checkbox.bind(active=self.set_active)
+        self.label = PlaylistCreatorLabel(text=self.text, pos_hint=self.pos_hint)
+
+        self.add_widget(self.checkbox)
+        self.add_widget(self.label)
+
+    def set_active(self, checkbox, value):
+        self.active = value
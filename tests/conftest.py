@@ -0,0 +1,25 @@
+import pytest
+
+# importing the benchmarks package puts src/ on sys.path for the modules under test too
+from benchmarks.fake_spotify import FakeLibrary, FakeSpotifyServer
+from spotify_client import RequestScheduler
+
+
+@pytest.fixture
+def library_size():
+    return 100
+
+
+@pytest.fixture
+def server(library_size):
+    with FakeSpotifyServer(FakeLibrary(library_size)) as server:
+        yield server
+
+
+@pytest.fixture
+def make_client(server):
+    def make_client(cache=None):
+        # the fake API has no rate limit to stay under
+        return server.client(cache=cache, scheduler=RequestScheduler(rate=1000, burst=1000))
+
+    return make_client
@@ -0,0 +1,115 @@
+import pytest
+import spotipy
+
+from benchmarks.fake_spotify import FakeLibrary, FakeYTMusic
+from cache import ResponseCache
+from exceptions import MigrationError
+from migrator import MigrationJournal, Yt2SpMigrator, migrate
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def library_size():
+    # Your Top Songs 2020 gets 150 tracks, more than one playlist write
+    return 300
+
+
+@pytest.fixture
+def make_migrator(server, make_client, tmp_path):
+    def make_migrator() -> Yt2SpMigrator:
+        sp = make_client(ResponseCache(str(tmp_path / "cache.sqlite")))
+        return Yt2SpMigrator(None, None, sp=sp, ytmusic=FakeYTMusic(server.library))
+
+    return make_migrator
+
+
+def interrupt_after(migrator: Yt2SpMigrator, calls: int):
+    # the process dies after `calls` more playlist writes have gone through
+    add_items = migrator.sp.playlist_add_items
+
+    def playlist_add_items(*args, **kwargs):
+        nonlocal calls
+        if calls == 0:
+            raise Interrupted
+        calls -= 1
+        return add_items(*args, **kwargs)
+
+    migrator.sp.playlist_add_items = playlist_add_items
+
+
+class KilledJournal(MigrationJournal):
+    # the process dies after the stage's writes, before its checkpoint is saved
+    def __init__(self, path: str, stage: str):
+        super().__init__(path)
+        self.killed_stage = stage
+
+    def record(self, name: str, **values):
+        if name == self.killed_stage and values.get("done"):
+            raise Interrupted
+        super().record(name, **values)
+
+
+def playlist_tracks(library: FakeLibrary, name: str) -> list:
+    [playlist] = [p for p in library.playlists.values() if p["name"] == name]
+    return playlist["track_ids"]
+
+
+def playlist_name_2020(journal_path: str) -> str:
+    return MigrationJournal(journal_path).stage("name_2020")["result"]
+
+
+def assert_merged(library: FakeLibrary, journal_path: str):
+    top = playlist_tracks(library, "Your Top Songs 2020")
+    review = playlist_tracks(library, playlist_name_2020(journal_path))
+    united = playlist_tracks(library, "United 2020 top")
+    assert united == list(dict.fromkeys(top + review))
+
+
+def test_merge_resumed_mid_stage_adds_no_duplicates(server, make_migrator, tmp_path):
+    journal_path = str(tmp_path / "journal.json")
+    migrator = make_migrator()
+    # one write for the 2020 review playlist, then the merge stops after its first batch
+    interrupt_after(migrator, 2)
+    with pytest.raises(Interrupted):
+        migrate(migrator, MigrationJournal(journal_path))
+    assert len(playlist_tracks(server.library, "United 2020 top")) == 100
+
+    migrate(make_migrator(), MigrationJournal(journal_path))
+    assert_merged(server.library, journal_path)
+
+
+def test_merge_resumed_before_checkpoint_adds_no_duplicates(server, make_migrator, tmp_path):
+    journal_path = str(tmp_path / "journal.json")
+    with pytest.raises(Interrupted):
+        migrate(make_migrator(), KilledJournal(journal_path, "merge_2020"))
+    written = len(playlist_tracks(server.library, "United 2020 top"))
+
+    migrate(make_migrator(), MigrationJournal(journal_path))
+    assert len(playlist_tracks(server.library, "United 2020 top")) == written
+    assert_merged(server.library, journal_path)
+
+
+def test_failed_like_batches_are_retried_on_resume(server, make_migrator, tmp_path):
+    journal_path = str(tmp_path / "journal.json")
+    migrator = make_migrator()
+    save_tracks = migrator.sp.current_user_saved_tracks_add
+    calls = 0
+
+    def current_user_saved_tracks_add(track_ids):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise spotipy.SpotifyException(500, -1, "Server error")
+        return save_tracks(track_ids)
+
+    migrator.sp.current_user_saved_tracks_add = current_user_saved_tracks_add
+    with pytest.raises(MigrationError):
+        migrate(migrator, MigrationJournal(journal_path))
+    assert not MigrationJournal(journal_path).stage("like").get("done")
+
+    migrate(make_migrator(), MigrationJournal(journal_path))
+    liked = {track_id for track_id, _ in server.library.saved}
+    assert set(MigrationJournal(journal_path).stage("like")["track_ids"]) <= liked
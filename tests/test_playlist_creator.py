@@ -0,0 +1,39 @@
+import pytest
+
+from cache import ResponseCache, TokenStore
+from playlist_creator import PlaylistCreator
+from spotify_client import SpotifyAuth, TokenCacheHandler
+
+TOKEN_INFO = {"access_token": "token", "refresh_token": "refresh", "expires_at": 0, "scope": ""}
+
+
+@pytest.fixture
+def make_playlist_creator(make_client, tmp_path):
+    def make_playlist_creator(logged_in: bool) -> PlaylistCreator:
+        cache_path = str(tmp_path / "cache.sqlite")
+        sp = make_client(ResponseCache(cache_path))
+        token_store = TokenStore(cache_path)
+        token_store.set(sp.cache_namespace, TOKEN_INFO)
+        # requests keep using the fake token, the auth manager only tells whether one is stored
+        sp.auth_manager = SpotifyAuth(
+            client_id="client",
+            redirect_uri="http://127.0.0.1:8080",
+            cache_handler=TokenCacheHandler(
+                token_store, sp.cache_namespace if logged_in else "logged_out"
+            ),
+        )
+        return PlaylistCreator(sp=sp)
+
+    return make_playlist_creator
+
+
+def test_cached_profile_is_dropped_when_no_token_is_stored(server, make_playlist_creator):
+    me = server.library.me
+    for _ in range(2):
+        user = make_playlist_creator(logged_in=True).current_user
+        assert user["id"] == me
+    assert server.requests["me"] == 1
+
+    user = make_playlist_creator(logged_in=False).current_user
+    assert user["id"] == me
+    assert server.requests["me"] == 2
@@ -0,0 +1,110 @@
+import pytest
+import requests
+import spotipy
+
+from benchmarks.fake_spotify import FakeError
+from cache import ResponseCache
+from playlist_creator import PlaylistCreator
+from spotify_client import PlaylistIndex, RequestScheduler, SpotifyClient
+
+
+@pytest.fixture
+def library_size():
+    # 100 generated playlists and the account's own two, listed over three pages
+    return 1000
+
+
+def run_requests(scheduler: RequestScheduler, count: int):
+    for _ in range(count):
+        scheduler.acquire()
+        scheduler.release()
+
+
+def test_scheduler_rate_grows_while_requests_succeed():
+    scheduler = RequestScheduler(rate=10.0, burst=1000, max_rate=40.0)
+    run_requests(scheduler, 8)
+    assert scheduler.rate == 18.0
+    run_requests(scheduler, 100)
+    assert scheduler.rate == 40.0
+
+
+def test_scheduler_rate_halves_on_throttling():
+    scheduler = RequestScheduler(rate=10.0, burst=1000, min_rate=4.0)
+    for expected in (5.0, 4.0):
+        scheduler.acquire()
+        scheduler.release(retry_after=0)
+        assert scheduler.rate == expected
+    assert scheduler.concurrency == 2
+
+
+def test_scheduler_stops_waiting_for_a_slot_that_never_frees_up():
+    scheduler = RequestScheduler(burst=1000, max_concurrency=1, acquire_timeout=0.1)
+    scheduler.acquire()
+    with pytest.raises(TimeoutError):
+        scheduler.acquire()
+
+
+def test_connection_errors_give_the_scheduler_slot_back():
+    scheduler = RequestScheduler(rate=1000, burst=1000, max_concurrency=2)
+    # nothing listens on port 1
+    sp = SpotifyClient(auth="fake-token", retries=0, scheduler=scheduler)
+    sp.prefix = "http://127.0.0.1:1/v1/"
+    for _ in range(3):
+        with pytest.raises(requests.ConnectionError):
+            sp.current_user()
+    assert scheduler._in_flight == 0
+
+
+def test_server_errors_are_not_taken_for_throttling(server, monkeypatch):
+    calls = []
+
+    def handle(method, path, query, body):
+        calls.append(path)
+        raise FakeError(503, "Service unavailable")
+
+    monkeypatch.setattr(server, "handle", handle)
+    scheduler = RequestScheduler(rate=1000, burst=1000, max_concurrency=2)
+    sp = server.client(scheduler=scheduler, retries=2, status_retries=2, backoff_factor=0)
+    with pytest.raises(spotipy.SpotifyException):
+        sp.current_user()
+    # urllib3's retries only, the scheduler doesn't start the cycle over
+    assert len(calls) == 3
+    assert (scheduler.rate, scheduler.concurrency) == (1000, 2)
+    assert scheduler._in_flight == 0
+
+
+def test_playlist_index_picks_up_changes_on_any_page(server, make_client):
+    # uncached, so that changes made behind the client's back show up at once
+    index = PlaylistIndex(make_client())
+    me = server.library.me
+    index.refresh(me)
+    assert server.requests["users/{id}/playlists"] == 3
+
+    server.library.create_playlist(me, "New")
+    assert index.get(me, "New")
+    assert len(index.playlists(me)) == 103
+
+    # on the last of the three pages
+    renamed = server.library.user_playlists[me][101]
+    old_name = server.library.playlists[renamed]["name"]
+    server.library.rename_playlist(renamed, "Renamed")
+    assert index.get(me, "Renamed")["id"] == renamed
+    assert index.get(me, old_name) is None
+
+    deleted = server.library.user_playlists[me].pop(80)
+    assert deleted not in {p["id"] for p in index.playlists(me)}
+
+
+def test_playlist_index_keeps_its_own_writes_current(server, make_client, tmp_path):
+    playlist_creator = PlaylistCreator(
+        sp=make_client(ResponseCache(str(tmp_path / "cache.sqlite")))
+    )
+    me = playlist_creator.current_user["id"]
+    playlist_creator.get_user_playlists(me)
+    playlist_creator.create_playlist("Mine", "", list(server.library.tracks)[:150])
+    mine = playlist_creator.get_playlist_by_name(me, "Mine")
+    assert mine["snapshot_id"] == server.library.playlists[mine["id"]]["snapshot_id"]
+
+    # the listing has nothing the index doesn't know already, so it is kept as it is
+    assert len(playlist_creator.get_user_playlists(me)) == 103
+    assert playlist_creator.get_playlist_by_name(me, "Mine") is mine